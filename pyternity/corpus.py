@@ -0,0 +1,127 @@
+import mmap
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+from typing import Iterable, Iterator
+
+from pyternity import features
+from pyternity.feature_cache import hash_source
+from pyternity.utils import *
+
+# Per project corpus folder, the lock with which writing to it is serialized
+corpus_locks: defaultdict[Path, threading.Lock] = defaultdict(threading.Lock)
+corpus_locks_lock = threading.Lock()
+
+
+class ProjectCorpus:
+    """
+    The Python files of the stored releases of a project, packed in a single blob file in which each distinct content is
+    stored once, and an index with per release its files (path and blob). Replaces the extracted folder per release in
+    the 'examples' folder: files that are shared by releases (which are most files) are only stored once, and the files
+    of a release are read from one memory-mapped file, in the order these are stored in it.
+    Can be used from multiple threads.
+    """
+
+    def __init__(self, project_name: str, corpus_dir: Path = CORPUS_DIR):
+        self.directory = corpus_dir / project_name
+        self.blobs_file = self.directory / 'blobs.bin'
+        self.index_file = self.directory / 'index.sqlite'
+        with corpus_locks_lock:
+            self.lock = corpus_locks[self.directory]
+
+    @contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(self.index_file)
+        try:
+            with connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS blobs (content_hash TEXT PRIMARY KEY, offset INTEGER, length INTEGER)"
+                )
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS files ("
+                    "version TEXT, path TEXT, content_hash TEXT, PRIMARY KEY (version, path)) WITHOUT ROWID"
+                )
+                # Only releases of which all files are stored
+                connection.execute("CREATE TABLE IF NOT EXISTS releases (version TEXT PRIMARY KEY)")
+                yield connection
+        finally:
+            connection.close()
+
+    def contains(self, version: str) -> bool:
+        if not self.index_file.exists():
+            return False
+
+        with self.connect() as connection:
+            return connection.execute("SELECT 1 FROM releases WHERE version = ?", (version,)).fetchone() is not None
+
+    def save(self, version: str, source_files: Iterable[SourceFile]) -> None:
+        """
+        Store the files of the release (replacing the files stored before, if any), only new contents are appended
+        """
+        with self.lock, self.connect() as connection, self.blobs_file.open('ab') as blobs:
+            connection.execute("DELETE FROM releases WHERE version = ?", (version,))
+            connection.execute("DELETE FROM files WHERE version = ?", (version,))
+
+            # Contents that are written but not yet indexed (when e.g. the run was stopped) are simply not used
+            offset = blobs.tell()
+            for path, source in source_files:
+                content_hash = hash_source(source)
+                is_new = connection.execute(
+                    "INSERT OR IGNORE INTO blobs VALUES (?, ?, ?)", (content_hash, offset, len(source))
+                ).rowcount
+                if is_new:
+                    blobs.write(source)
+                    offset += len(source)
+
+                connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?)", (version, path, content_hash))
+
+            # The contents have to be written before they are indexed
+            blobs.flush()
+            connection.execute("INSERT INTO releases VALUES (?)", (version,))
+
+    def read(self, version: str) -> Iterator[SourceFile]:
+        """
+        :return: Per stored file of the release, its path and contents (in the order these are stored)
+        """
+        with self.connect() as connection:
+            # An empty content has the same offset as the content that is stored after it, and files with the same
+            # content share it, so these ties are ordered as well
+            rows = connection.execute(
+                "SELECT path, offset, length FROM files JOIN blobs USING (content_hash) WHERE version = ? "
+                "ORDER BY offset, length, path", (version,)
+            ).fetchall()
+
+        if not rows:
+            return
+
+        with self.blobs_file.open('rb') as blobs:
+            if self.blobs_file.stat().st_size == 0:
+                # An empty file can not be memory-mapped, so all files are empty
+                yield from ((path, b"") for path, _, _ in rows)
+                return
+
+            with mmap.mmap(blobs.fileno(), 0, access=mmap.ACCESS_READ) as blobs_map:
+                for path, offset, length in rows:
+                    yield path, blobs_map[offset:offset + length]
+
+
+def import_examples_dir(examples_dir: Path = EXAMPLES_DIR, corpus_dir: Path = CORPUS_DIR) -> int:
+    """
+    Import the extracted releases of the (old) 'examples' folder, which contains a folder per project and release
+    :return: Amount of imported releases
+    """
+    release_dirs = sorted(path for path in examples_dir.glob('*/*') if path.is_dir())
+    for release_dir in release_dirs:
+        source_files = ((Path(path).relative_to(release_dir).as_posix(), source)
+                        for path, source in features.read_source_files(release_dir))
+        ProjectCorpus(release_dir.parent.name, corpus_dir).save(release_dir.name, source_files)
+
+    return len(release_dirs)
+
+
+if __name__ == '__main__':
+    # Usage: python -m pyternity.corpus [examples_dir]
+    amount = import_examples_dir(Path(sys.argv[1]) if len(sys.argv) > 1 else EXAMPLES_DIR)
+    print(f"Imported {amount} releases into {CORPUS_DIR}")
@@ -0,0 +1,57 @@
+import json
+import sqlite3
+import threading
+from typing import Iterable, Self
+
+from pyternity.utils import *
+
+
+def hash_source(source: bytes) -> str:
+    return hashlib.sha256(source).hexdigest()
+
+
+class FeatureCache:
+    """
+    Cache with the detected features per file, keyed on the hash of the file contents and the analyzer fingerprint.
+    Consecutive releases of a project share most of their files, such that these only have to be analyzed once.
+    Can be used from multiple threads.
+    """
+
+    def __init__(self, cache_file: Path = FEATURE_CACHE_FILE):
+        self.fingerprint = analyzer_fingerprint(with_file_filter=False)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(cache_file, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS file_features ("
+            "fingerprint TEXT, content_hash TEXT, features TEXT, PRIMARY KEY (fingerprint, content_hash))"
+        )
+
+    def get(self, content_hash: str) -> FileFeatures | None:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT features FROM file_features WHERE fingerprint = ? AND content_hash = ?",
+                (self.fingerprint, content_hash)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        return Counter({(version, feature): count for version, feature, count in json.loads(row[0])})
+
+    def set_many(self, file_features: Iterable[tuple[str, FileFeatures]]) -> None:
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO file_features VALUES (?, ?, ?)",
+                ((self.fingerprint, content_hash, json.dumps([(*key, count) for key, count in features.items()]))
+                 for content_hash, features in file_features)
+            )
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
@@ -0,0 +1,108 @@
+import threading
+from array import array
+from typing import Iterable, NamedTuple
+
+import numpy as np
+
+from pyternity.utils import *
+
+# Per Python version, its index in PYTHON_RELEASES
+VERSION_INDICES = {python_version: i for i, python_version in enumerate(PYTHON_RELEASES)}
+
+
+class FeatureVector(NamedTuple):
+    """
+    Sparse vector with the features of a release: the ids of its features and how often each of them was detected
+    """
+    ids: np.ndarray
+    counts: np.ndarray
+
+
+class FeatureRegistry:
+    """
+    Maps each (Python version, feature) to an integer id, such that the features of releases can be stored and summed
+    as arrays, instead of as nested dicts with the full feature names. Ids are only valid within the current process.
+    Can be used from multiple threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids: dict[tuple[str, str], int] = {}
+        self.keys: list[tuple[str, str]] = []
+        # Per feature id, the index of its Python version in PYTHON_RELEASES
+        self.version_indices = array('I')
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def intern(self, python_version: str, feature: str) -> int:
+        """
+        :return: The id of the feature, which is registered if it was not yet
+        """
+        key = (python_version, feature)
+        if (feature_id := self.ids.get(key)) is not None:
+            return feature_id
+
+        with self.lock:
+            if (feature_id := self.ids.get(key)) is None:
+                feature_id = len(self.keys)
+                self.keys.append(key)
+                self.version_indices.append(VERSION_INDICES[python_version])
+                self.ids[key] = feature_id
+
+        return feature_id
+
+    def to_vector(self, features: dict[str, dict[str, int]]) -> FeatureVector:
+        """
+        :param features: Per Python version, how often each feature was detected
+        """
+        ids = [self.intern(python_version, feature) for python_version, fs in features.items() for feature in fs]
+        counts = [count for fs in features.values() for count in fs.values()]
+        return FeatureVector(np.array(ids, dtype=np.uint32), np.array(counts, dtype=np.uint32))
+
+    def to_features(self, vector: FeatureVector) -> dict[str, dict[str, int]]:
+        """
+        :return: The features of the vector, in the same (sorted) form as `sort_features` returns
+        """
+        features = defaultdict(dict)
+        for feature_id, count in zip(vector.ids.tolist(), vector.counts.tolist()):
+            python_version, feature = self.keys[feature_id]
+            features[python_version][feature] = count
+
+        return sort_features(features)
+
+    def count_features(self, vectors: Iterable[FeatureVector], initial: np.ndarray | None = None) -> np.ndarray:
+        """
+        :param vectors: Features of (e.g.) all releases of the corpus
+        :param initial: Counts (as returned earlier) to add the counts of these vectors to
+        :return: Per feature id, how often it was detected in total in these vectors
+        """
+        vectors = list(vectors)
+        feature_counts = np.zeros(len(self), dtype=np.int64)
+        if vectors:
+            ids = np.concatenate([vector.ids for vector in vectors])
+            counts = np.concatenate([vector.counts for vector in vectors])
+            feature_counts = np.bincount(ids, weights=counts, minlength=len(self)).astype(np.int64)
+
+        if initial is not None:
+            # Features may have been registered since the initial counts were calculated
+            feature_counts[:len(initial)] += initial
+
+        return feature_counts
+
+    def to_counters(self, feature_counts: np.ndarray) -> dict[str, Counter]:
+        """
+        :param feature_counts: Per feature id, how often it was detected (as returned by `count_features`)
+        :return: Per Python version, how often each feature was detected
+        """
+        counters = {python_version: Counter() for python_version in PYTHON_RELEASES}
+        detected_ids = np.flatnonzero(feature_counts)
+        for feature_id, count in zip(detected_ids.tolist(), feature_counts[detected_ids].tolist()):
+            python_version, feature = self.keys[feature_id]
+            counters[python_version][feature] = count
+
+        return counters
+
+
+# Shared by all results of a run, such that their vectors can be summed
+feature_registry = FeatureRegistry()
@@ -1,44 +1,553 @@
 import contextlib
+import cProfile
 import multiprocessing
+import os
+import threading
+import time
+import tracemalloc
+from functools import partial
+from itertools import count, islice
+from multiprocessing.queues import SimpleQueue
+from typing import Any, Callable, Iterable, Iterator, NamedTuple, Self, Sequence
 
+from vermin import InvalidVersionException, Parser, SourceVisitor, version_strings
+
+from pyternity.feature_cache import FeatureCache, hash_source
 from pyternity.utils import *
 
+# Path that code which is not read from a file is reported as
+SOURCE_PATH = '<source>'
+# Amount of sources that is sent to a worker at once by `get_features_from_sources`
+SOURCES_CHUNK_SIZE = 32
+# Files that are nested too deep are analyzed again in a thread with this stack size and recursion limit
+DEEP_STACK_SIZE = 512 * 1024 * 1024
+DEEP_RECURSION_LIMIT = 100_000
+# Seconds to wait on the result of a worker process, before checking whether any worker process crashed
+WORKER_POLL_SECONDS = 1.0
+# Serializes `call_with_deep_stack`, since the stack size and recursion limit are set for the whole process
+deep_stack_lock = threading.Lock()
+
+
+class Budget(NamedTuple):
+    """
+    Limits of the analysis of a single file, a file that exceeds them is skipped (None means no limit)
+    """
+    seconds: float | None = None
+    # In bytes
+    memory: int | None = None
+
+
+class FileProfile(NamedTuple):
+    """
+    Measurements of the analysis of a single file, the AST node count only in profiling mode,
+    and the peak memory only when tracing the memory
+    """
+    seconds: float
+    nodes: int | None = None
+    # In bytes
+    peak_memory: int | None = None
+    # Why the file was skipped, when its analysis failed or exceeded its budget
+    skipped: str | None = None
+    # Whether the skipped file may not be skipped next time (e.g. with another budget, or when its worker process
+    # crashed on a one-off), instead of failing the same way again
+    retry: bool = False
+
+
+# Called with the path, contents and profile of each analyzed file
+OnAnalyzed: TypeAlias = Callable[[str, bytes, FileProfile], None]
+# Analyzes the file with the given path and contents
+Analyze: TypeAlias = Callable[[str, bytes], tuple[FileFeatures | None, FileProfile]]
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class FeatureVisitor(SourceVisitor):
+    """
+    SourceVisitor that tallies the detected features directly, instead of formatting them as (parsable) output lines.
+    """
+
+    def __init__(self, config: vermin.Config, path: str | None = None, source: bytes | None = None):
+        super().__init__(config, path, source)
+        self.file_features: FileFeatures = Counter()
+
+    # Overrides the name-mangled SourceVisitor.__verbose_print, through which every detected feature is reported
+    def _SourceVisitor__verbose_print(self, msg, level, entity=None, line=None, versions=None, plural=None):
+        config = self._SourceVisitor__config
+        if not self._SourceVisitor__violates_target_versions(versions) or config.verbose() < level:
+            return
+
+        # Only features that belong to a specific version are of interest
+        if versions is None:
+            return
+
+        # Some features are both specified in 2.7 and 3.1 (like argparse module)
+        # But don't include general 3.0, if features was already added by a python 2.x version
+        py2, py3 = version_strings(versions, ':').split(':')
+        min_v2, min_v3 = parse_vermin_version(py2), parse_vermin_version(py3)
+        feature = (msg or '').replace('\n', '\\n')
+
+        if min_v2:
+            self.file_features[min_v2, feature] += 1
+        if min_v3 and (not min_v2 or min_v3 != '3.0'):
+            self.file_features[min_v3, feature] += 1
+
+
+class ProfilingVisitor(FeatureVisitor):
+    """
+    FeatureVisitor that counts the visited AST nodes, and stops the analysis once the file exceeds its budget.
+    The memory is measured with tracemalloc, which should already be tracing before the file is parsed
+    (only when there is a memory budget).
+    """
+
+    def __init__(self, config: vermin.Config, path: str, source: bytes, budget: Budget, start: float):
+        super().__init__(config, path, source)
+        self.budget = budget
+        self.start = start
+        self.nodes = 0
+
+    def visit(self, node):
+        self.nodes += 1
+        self.check_budget()
+        return super().visit(node)
+
+    def check_budget(self) -> None:
+        if self.budget.seconds is not None and time.perf_counter() - self.start > self.budget.seconds:
+            raise BudgetExceeded(f"took more than {self.budget.seconds}s")
+        if self.budget.memory is not None and tracemalloc.get_traced_memory()[1] > self.budget.memory:
+            raise BudgetExceeded(f"used more than {self.budget.memory / 1e6:.0f} MB")
+
+
+def get_source_features(path: str, source: bytes, visitor: FeatureVisitor | None = None) -> FileFeatures | None:
+    """
+    Same as `vermin.process_individual`, but returns the detected features of the source instead of its output text.
+    :param path: Path of the file the source belongs to
+    :param source: Contents of the file
+    :param visitor: Visitor to detect the features with, e.g. a ProfilingVisitor (a FeatureVisitor when not given)
+    :return: The features detected in this file, or None when the source is not Python code
+    """
+    config = Config.vermin
+
+    try:
+        node, _, novermin = Parser(source, path).detect(config)
+    except (ValueError, TypeError):
+        # Not Python code, e.g. source containing null bytes (other errors, like a RecursionError of a file that is
+        # nested too deep, are handled by `contain_errors`)
+        return None
+
+    if node is None:
+        # Syntax errors
+        return Counter()
+
+    if visitor is None:
+        visitor = FeatureVisitor(config, path, source)
+    visitor.set_no_lines(novermin)
+    visitor.tour(node)
+
+    try:
+        # Most features (like modules and members) are only reported when determining the minimum versions
+        visitor.minimum_versions()
+    except InvalidVersionException:
+        # Incompatible versions were detected, so (like Vermin) don't report any features for this file
+        return Counter()
+
+    return visitor.file_features
+
+
+def profile_source_features(path: str, source: bytes, budget: Budget = Budget(),
+                            trace_memory: bool = True) -> tuple[FileFeatures | None, FileProfile]:
+    """
+    Same as `get_source_features`, but also measures the AST node count (and peak memory) of the analysis,
+    which is stopped once the file exceeds the budget
+    :param trace_memory: Whether to measure the peak memory, which makes the analysis several times slower
+    (always done when there is a memory budget)
+    :return: The features detected in this file (None when it was skipped), and its profile
+    """
+    trace_memory = trace_memory or budget.memory is not None
+    if trace_memory:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    visitor = ProfilingVisitor(Config.vermin, path, source, budget, start)
+    skipped, retry, peak_memory = None, False, None
+    try:
+        file_features = get_source_features(path, source, visitor)
+        # Parsing and determining the minimum versions are not interrupted, so check the budget afterwards as well
+        visitor.check_budget()
+    except BudgetExceeded as e:
+        file_features, skipped, retry = None, str(e), True
+    finally:
+        if trace_memory:
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    return file_features, FileProfile(time.perf_counter() - start, visitor.nodes, peak_memory, skipped, retry)
+
+
+def time_source_features(path: str, source: bytes) -> tuple[FileFeatures | None, FileProfile]:
+    """
+    Same as `get_source_features`, but also measures the time it took to detect the features
+    """
+    start = time.perf_counter()
+    file_features = get_source_features(path, source)
+    return file_features, FileProfile(time.perf_counter() - start)
+
+
+def call_with_deep_stack(analyze: Analyze, path: str, source: bytes) -> tuple[FileFeatures | None, FileProfile]:
+    """
+    Analyze the file in a new thread with a larger stack, while the recursion limit is raised.
+    Only one file is analyzed like this at a time (per process), such that the original limits are always restored.
+    """
+    result = []
+
+    def target() -> None:
+        try:
+            result.append(analyze(path, source))
+        except Exception as e:
+            result.append(e)
+
+    with deep_stack_lock:
+        stack_size = threading.stack_size(DEEP_STACK_SIZE)
+        recursion_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(DEEP_RECURSION_LIMIT)
+        try:
+            thread = threading.Thread(target=target, name='pyternity-deep-stack')
+            thread.start()
+            thread.join()
+        finally:
+            threading.stack_size(stack_size)
+            sys.setrecursionlimit(recursion_limit)
+
+    if isinstance(result[0], Exception):
+        raise result[0]
+    return result[0]
+
+
+def contain_errors(analyze: Analyze, path: str, source: bytes) -> tuple[FileFeatures | None, FileProfile]:
+    """
+    Analyze the file, such that an error only skips this file instead of the whole release.
+    A file that is nested too deep for the default recursion limit is analyzed again with `call_with_deep_stack`.
+    :return: The features detected in this file (None when it was skipped), and its profile
+    """
+    start = time.perf_counter()
+    try:
+        try:
+            return analyze(path, source)
+        except RecursionError:
+            file_features, profile = call_with_deep_stack(analyze, path, source)
+            return file_features, profile._replace(seconds=time.perf_counter() - start)
+    except Exception as e:
+        return None, FileProfile(time.perf_counter() - start, skipped=f"raised {type(e).__name__}: {e}")
+
+
+def get_keyed_source_features(args: tuple[str, str, bytes]) -> tuple[str, FileFeatures | None, FileProfile]:
+    """
+    :return: The key, the features of the source (None when it was skipped) and the time it took to detect them
+    """
+    key, path, source = args
+    return key, *contain_errors(time_source_features, path, source)
+
+
+def get_keyed_profiled_source_features(budget: Budget, trace_memory: bool,
+                                       args: tuple[str, str, bytes]) -> tuple[str, FileFeatures | None, FileProfile]:
+    key, path, source = args
+    analyze = partial(profile_source_features, budget=budget, trace_memory=trace_memory)
+    return key, *contain_errors(analyze, path, source)
+
+
+# In a worker process of a FeaturePool, the queue to which it reports which task it starts
+started_tasks: SimpleQueue | None = None
+
+
+def init_worker(vermin_config: vermin.Config, started_tasks_queue: SimpleQueue | None = None) -> None:
+    global started_tasks
+    Config.vermin = vermin_config
+    started_tasks = started_tasks_queue
+
+
+def run_task(function: Callable[[Any], Any], task: tuple[int, list[Any]]) -> tuple[int, list[Any]]:
+    """
+    Report that this worker process starts the task (such that the task is known when the process crashes), and run it
+    :param task: The id of the task, and the chunk of arguments to call the function with
+    :return: The id of the task, and the results of the function
+    """
+    task_id, chunk = task
+    if started_tasks is not None:
+        # Written synchronously, so it is not lost when the process crashes right after this
+        started_tasks.put((os.getpid(), task_id))
+    return task_id, [function(args) for args in chunk]
+
+
+class FeaturePool:
+    """
+    Worker processes to detect features with, which can be shared by all `get_features` calls of a run.
+    That way the processes (and the Vermin config they use) only have to be set up once.
+    When a budget is given, the files are analyzed in profiling mode (see `profile_source_features`).
+    """
+
+    def __init__(self, processes: int = Config.vermin.processes(), cache: FeatureCache | None = None,
+                 budget: Budget | None = None, trace_memory: bool = False):
+        self.processes = processes
+        self.cache = cache
+        self.budget = budget
+        self.trace_memory = trace_memory
+        self.pool = None
+        if processes != 1:
+            self.started_tasks = multiprocessing.SimpleQueue()
+            self.pool = multiprocessing.Pool(processes, init_worker, (Config.vermin, self.started_tasks))
+
+        # Worker processes can be shared by multiple threads, which all keep track of the tasks of the workers
+        self.tasks_lock = threading.Lock()
+        self.task_ids = count()
+        # Per worker process, the id of the last task it started
+        self.running_tasks: dict[int, int] = {}
+        # Tasks that were running in a worker process that crashed
+        self.crashed_tasks: set[int] = set()
+        self.worker_crashed = False
+
+    def imap_unordered(self, source_files: Iterable[SourceFile],
+                       on_analyzed: OnAnalyzed | None = None) -> Iterator[FileFeatures | None]:
+        """
+        Detect the features of each of the given source files, the results are yielded in arbitrary order.
+        When a cache is used, only files with new content are analyzed.
+        :param on_analyzed: Called for each file that is analyzed (so not for cached files)
+        """
+        if self.cache is None:
+            # Per path, the contents of (the last) file with that path
+            sources: dict[str, bytes] = {}
+
+            def to_process() -> Iterator[tuple[str, str, bytes]]:
+                for path, source in source_files:
+                    if on_analyzed:
+                        sources[path] = source
+                    yield path, path, source
+
+            for path, file_features, profile in self.imap_keyed_unordered(to_process()):
+                if on_analyzed:
+                    on_analyzed(path, sources[path], profile)
+                yield file_features
+            return
+
+        # Per content hash, the amount of files with that content and one of these files
+        to_analyze: dict[str, tuple[int, SourceFile]] = {}
+        for path, source in source_files:
+            content_hash = hash_source(source)
+            if content_hash in to_analyze:
+                amount, source_file = to_analyze[content_hash]
+                to_analyze[content_hash] = amount + 1, source_file
+            elif (file_features := self.cache.get(content_hash)) is not None:
+                yield file_features
+            else:
+                to_analyze[content_hash] = 1, (path, source)
+
+        # Files with the same content (e.g. empty __init__.py files) only have to be analyzed once
+        to_process = ((content_hash, *source_file) for content_hash, (_, source_file) in to_analyze.items())
+        new_file_features = []
+        for content_hash, file_features, profile in self.imap_keyed_unordered(to_process):
+            if on_analyzed:
+                on_analyzed(*to_analyze[content_hash][1], profile)
+
+            file_features = file_features or Counter()
+            # Skipped files are analyzed again next time, e.g. with another budget
+            if not profile.skipped:
+                new_file_features.append((content_hash, file_features))
+            for _ in range(to_analyze[content_hash][0]):
+                yield file_features
+
+        self.cache.set_many(new_file_features)
+
+    def imap_keyed_unordered(self, to_process: Iterable[tuple[str, str, bytes]],
+                             chunksize: int = 1) -> Iterator[tuple[str, FileFeatures | None, FileProfile]]:
+        """
+        Detect the features of each source without using the cache, the results are yielded in arbitrary order
+        :param to_process: Per source, a key to identify its result with, its path and its contents
+        :param chunksize: Amount of sources that is sent to a worker process at once
+        :return: Per source, its key, its features (None when it was skipped) and its profile
+        """
+        if self.budget is None:
+            function = get_keyed_source_features
+        else:
+            function = partial(get_keyed_profiled_source_features, self.budget, self.trace_memory)
+
+        if self.pool is None:
+            return map(function, to_process)
+        return self._imap_pool(function, to_process, chunksize)
+
+    def _imap_pool(self, function: Callable[[tuple[str, str, bytes]], tuple[str, FileFeatures | None, FileProfile]],
+                   to_process: Iterable[tuple[str, str, bytes]],
+                   chunksize: int) -> Iterator[tuple[str, FileFeatures | None, FileProfile]]:
+        """
+        Same as `Pool.imap_unordered`, but the sources of a worker process that crashed (e.g. on a segmentation fault)
+        are skipped, instead of waiting on their results forever
+        """
+        # Per id of a task (a chunk of sources) without result yet, the keys of its sources
+        pending: dict[int, list[str]] = {}
+        all_submitted = threading.Event()
+
+        def submit() -> Iterator[tuple[int, list[tuple[str, str, bytes]]]]:
+            to_process_iter = iter(to_process)
+            while chunk := list(islice(to_process_iter, chunksize)):
+                with self.tasks_lock:
+                    task_id = next(self.task_ids)
+                pending[task_id] = [key for key, _, _ in chunk]
+                yield task_id, chunk
+            all_submitted.set()
+
+        results = self.pool.imap_unordered(partial(run_task, function), submit())
+        while not (all_submitted.is_set() and not pending):
+            try:
+                task_id, chunk_results = results.next(WORKER_POLL_SECONDS)
+            except StopIteration:
+                return
+            except multiprocessing.TimeoutError:
+                yield from self._crashed_results(pending)
+                continue
+            finally:
+                self._update_running_tasks()
+
+            del pending[task_id]
+            yield from chunk_results
+
+    def _update_running_tasks(self) -> None:
+        with self.tasks_lock:
+            while not self.started_tasks.empty():
+                pid, task_id = self.started_tasks.get()
+                self.running_tasks[pid] = task_id
+
+    def _crashed_results(self, pending: dict[int, list[str]]) -> Iterator[tuple[str, FileFeatures | None, FileProfile]]:
+        """
+        :param pending: The tasks without result yet, of which the crashed ones are removed
+        :return: The skipped results of the pending tasks that were running in a worker process that crashed
+        """
+        self._update_running_tasks()
+        alive = {process.pid for process in multiprocessing.active_children()}
+        with self.tasks_lock:
+            for pid in [pid for pid in self.running_tasks if pid not in alive]:
+                logger.error(f"Worker process {pid} crashed, skipping the files it was analyzing")
+                self.crashed_tasks.add(self.running_tasks.pop(pid))
+                self.worker_crashed = True
+            crashed = self.crashed_tasks & pending.keys()
+            self.crashed_tasks -= crashed
+
+        for task_id in crashed:
+            keys = pending.pop(task_id)
+            # Only one file of a chunk crashed the process, but the results of the whole chunk are lost.
+            # The crash may be a one-off (e.g. killed when out of memory), so the files are analyzed again next time
+            reason = "crashed its worker process" if len(keys) == 1 else \
+                "crashed its worker process, or was analyzed in the same chunk as a file that did"
+            yield from ((key, None, FileProfile(0.0, skipped=reason, retry=True)) for key in keys)
+
+    def close(self) -> None:
+        if self.pool is not None:
+            # The results of crashed tasks never arrive, so the pool has to be terminated instead of waiting on them
+            if self.worker_crashed:
+                self.pool.terminate()
+            else:
+                self.pool.close()
+            self.pool.join()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
+def read_source_files(project_folder: Path) -> Iterator[SourceFile]:
+    # Select all Python paths in this folder (when it is a directory)
+    paths = project_folder.rglob('*') if project_folder.is_dir() else [project_folder]
+
+    for path in paths:
+        if path.is_file():
+            yield str(path), path.read_bytes()
+
 
 # TODO Check we if we need Backports, see --help
-def get_features(project_folder: Path, processes: int = Config.vermin.processes()) -> Features:
+def get_features(project_folder: Path, processes: int = Config.vermin.processes(),
+                 pool: FeaturePool | None = None) -> Features:
+    """
+    :param project_folder: Python file, or folder with Python files, to detect the features of
+    :param processes: Amount of processes to use, only used when no `pool` is given
+    :param pool: Pool of workers to use, when not given a new pool is created (and closed) for this call
+    :return: The detected features (of the files that pass the file filter, relative to the folder)
+    """
     assert project_folder.exists()
+    root = project_folder if project_folder.is_dir() else project_folder.parent
+    source_files = Config.file_filter.filter(read_source_files(project_folder), root)
+    return get_features_from_source_files(source_files, processes, pool)
 
-    # Select all Python paths in this folder (when it is a directory)
-    py_paths = project_folder.rglob('*') if project_folder.is_dir() else [project_folder]
 
+def get_features_from_source_files(source_files: Iterable[SourceFile], processes: int = Config.vermin.processes(),
+                                   pool: FeaturePool | None = None, on_analyzed: OnAnalyzed | None = None) -> Features:
+    """
+    :param source_files: Per file, its path and contents, e.g. read directly from an (in-memory) archive
+    :param processes: Amount of processes to use, only used when no `pool` is given
+    :param pool: Pool of workers to use, when not given a new pool is created (and closed) for this call
+    :param on_analyzed: Called for each file that is analyzed, e.g. to record its analysis time
+    :return: The detected features
+    """
     # Per version, per feature
     detected_features = defaultdict(lambda: defaultdict(int))
-    with multiprocessing.Pool(processes) if processes != 1 else contextlib.nullcontext() as pool:
-        mapping = map if processes == 1 else pool.imap_unordered
-        to_process = ((path, Config.vermin) for path in py_paths)
-
-        for file_results in mapping(vermin.process_individual, to_process):
-            for line in file_results.text.splitlines():
-                # It also dumps the whole AST, skip that
-                # But we need print_visits=yes, else it will only output unique missing features
-                if line[0] == '|':
-                    continue
-
-                # Grab the features that were detected which belong to a specific version
-                # Format: file:line:column:py2:py3:feature
-                _, py2, py3, feature = line.rsplit(':', maxsplit=3)
-
-                # Some features are both specified in 2.7 and 3.1 (like argparse module)
-                # But don't include general 3.0, if features was already added by a python 2.x version
-                min_v2, min_v3 = parse_vermin_version(py2), parse_vermin_version(py3)
-
-                if min_v2:
-                    detected_features[min_v2][feature] += 1
-                if min_v3 and (not min_v2 or min_v3 != '3.0'):
-                    detected_features[min_v3][feature] += 1
+    with contextlib.nullcontext(pool) if pool else FeaturePool(processes) as pool:
+        for file_features in pool.imap_unordered(source_files, on_analyzed):
+            for (version, feature), count in (file_features or {}).items():
+                detected_features[version][feature] += count
 
     return detected_features
 
 
+def get_features_from_source(code: str, path: str = SOURCE_PATH) -> Features:
+    """
+    Detect the features of a single piece of code, in memory and in this process
+    :param code: String with the code
+    :param path: Path to report the code as (Vermin only uses it in its messages)
+    :return: The detected features
+    """
+    return get_features_from_source_files([(path, code.encode())], processes=1)
+
+
+def get_features_from_sources(sources: Sequence[str], processes: int = Config.vermin.processes(),
+                              pool: FeaturePool | None = None) -> list[Features]:
+    """
+    Detect the features of many pieces of code (e.g. test snippets) at once, in memory
+    :param sources: Strings with the code
+    :param processes: Amount of processes to use, only used when no `pool` is given
+    :param pool: Pool of workers to use, when not given a new pool is created (and closed) for this call
+    :return: Per source, the detected features (in the same order as the sources)
+    """
+    return [source_features for source_features, _ in get_profiled_features_from_sources(sources, processes, pool)]
+
+
+def get_profiled_features_from_sources(sources: Sequence[str], processes: int = Config.vermin.processes(),
+                                       pool: FeaturePool | None = None) -> list[tuple[Features, FileProfile]]:
+    """
+    Same as `get_features_from_sources`, but also returns the profile of each source (e.g. the time it took)
+    :return: Per source, the detected features and its profile (in the same order as the sources)
+    """
+    features_per_source = [defaultdict(lambda: defaultdict(int)) for _ in sources]
+    profiles: list[FileProfile | None] = [None] * len(sources)
+    to_process = ((str(i), SOURCE_PATH, code.encode()) for i, code in enumerate(sources))
+
+    with contextlib.nullcontext(pool) if pool else FeaturePool(processes) as pool:
+        # Sources are usually small, so send them to the workers in chunks
+        for key, file_features, profile in pool.imap_keyed_unordered(to_process, chunksize=SOURCES_CHUNK_SIZE):
+            profiles[int(key)] = profile
+            for (version, feature), count in (file_features or {}).items():
+                features_per_source[int(key)][version][feature] += count
+
+    return list(zip(features_per_source, profiles))
+
+
+def dump_profile(path: str, source: bytes, profile_file: Path, budget: Budget = Budget()) -> None:
+    """
+    Analyze the source again in profiling mode (in this process) with cProfile, and dump its stats to the profile file,
+    e.g. to view them with `python -m pstats` or snakeviz. The memory is not traced, as that distorts the stats.
+    """
+    profiler = cProfile.Profile()
+    profiler.runcall(profile_source_features, path, source, budget._replace(memory=None), False)
+    profiler.dump_stats(profile_file)
+
+
 def most_popular_per_version(all_features: Features):
     return {version: max(features, key=features.get) for version, features in sorted(all_features.items())}
@@ -0,0 +1,225 @@
+import http.client
+import json
+import os
+import threading
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+from typing import Any, Callable, Iterable, Iterator, NamedTuple, TypeVar
+from urllib.error import HTTPError
+from urllib.parse import urljoin, urlsplit, SplitResult
+
+from pyternity.utils import *
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+MAX_REDIRECTS = 5
+# Status of the error that is raised for a request that is not available in offline mode (as for an uncached resource)
+OFFLINE_STATUS = 504
+
+
+class Response(NamedTuple):
+    url: str
+    status: int
+    headers: http.client.HTTPMessage
+    body: bytes
+
+    def json(self) -> Any:
+        return json.loads(self.body)
+
+
+class HTTPCache:
+    """
+    On-disk cache of responses, which stores the validators (ETag/Last-Modified) to revalidate them with.
+    Each response is stored in its own file, such that it can be used from multiple threads.
+    """
+
+    def __init__(self, directory: Path = HTTP_CACHE_DIR):
+        self.directory = directory
+
+    def path(self, url: str) -> Path:
+        return self.directory / f"{hashlib.sha256(url.encode()).hexdigest()}.cache"
+
+    def load(self, url: str) -> Response | None:
+        try:
+            with self.path(url).open('rb') as f:
+                meta_data = json.loads(f.readline())
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+
+        headers = http.client.HTTPMessage()
+        for name, value in meta_data['headers'].items():
+            headers[name] = value
+
+        return Response(meta_data['url'], meta_data['status'], headers, body)
+
+    def save(self, url: str, response: Response) -> None:
+        # Only the validators are needed to revalidate the response later on
+        headers = {name: response.headers[name] for name in ('ETag', 'Last-Modified') if name in response.headers}
+        meta_data = {'url': response.url, 'status': response.status, 'headers': headers}
+
+        # Write to a temporary file first, such that other threads (or runs) never read a partially written file
+        self.directory.mkdir(exist_ok=True)
+        path = self.path(url)
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        with tmp_path.open('wb') as f:
+            f.write(json.dumps(meta_data).encode() + b'\n')
+            f.write(response.body)
+        os.replace(tmp_path, path)
+
+
+class HTTPClient:
+    """
+    Thread-safe HTTP client that reuses (keep-alive) connections,
+    and uses at most `max_connections_per_host` connections at the same time per host.
+    In offline mode, only the responses in the cache can be requested (with `get_cached`).
+    """
+
+    def __init__(self, max_connections_per_host: int = 4, timeout: float = 60, cache: HTTPCache | None = None,
+                 offline: bool = False):
+        self.max_connections_per_host = max_connections_per_host
+        self.timeout = timeout
+        self.cache = cache
+        self.offline = offline
+        self.lock = threading.Lock()
+        # Per host, the connections that are currently not in use and the semaphore limiting the connections
+        self.idle_connections: dict[str, list[http.client.HTTPConnection]] = defaultdict(list)
+        self.host_semaphores: dict[str, threading.BoundedSemaphore] = {}
+
+    def get(self, url: str, headers: dict[str, str] | None = None) -> Response:
+        """
+        Do a GET request, following redirects
+        :param url: The URL to request
+        :param headers: Extra headers to send
+        :return: The response, also for 304 Not Modified
+        :raises HTTPError: When the response has an (other) error status
+        """
+        if self.offline:
+            raise HTTPError(url, OFFLINE_STATUS, "Not available in offline mode", http.client.HTTPMessage(), None)
+
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self._get(urlsplit(url), headers or {})
+
+            if response.status in (301, 302, 303, 307, 308):
+                url = urljoin(url, response.headers['Location'])
+                continue
+
+            if response.status >= 400:
+                raise HTTPError(url, response.status, http.client.responses.get(response.status, ''),
+                                response.headers, None)
+
+            return response
+
+        raise HTTPError(url, 310, "Too many redirects", http.client.HTTPMessage(), None)
+
+    def is_unavailable_offline(self, error: HTTPError) -> bool:
+        """
+        :return: Whether the error was raised since the request is not available in offline mode
+        """
+        return self.offline and error.code == OFFLINE_STATUS
+
+    def get_cached(self, url: str, headers: dict[str, str] | None = None) -> Response:
+        """
+        Same as `get`, but the response is stored in the cache (if any). A cached response is revalidated with a
+        conditional request, such that the body is only downloaded again when it changed.
+        In offline mode, the cached response is returned without revalidating it.
+        """
+        cached = self.cache.load(url) if self.cache else None
+        if cached and self.offline:
+            return cached
+
+        conditional_headers = {}
+        if cached and 'ETag' in cached.headers:
+            conditional_headers['If-None-Match'] = cached.headers['ETag']
+        if cached and 'Last-Modified' in cached.headers:
+            conditional_headers['If-Modified-Since'] = cached.headers['Last-Modified']
+
+        response = self.get(url, (headers or {}) | conditional_headers)
+        if cached and response.status == 304:
+            return cached
+
+        if self.cache:
+            self.cache.save(url, response)
+
+        return response
+
+    def _get(self, url: SplitResult, headers: dict[str, str]) -> Response:
+        host = f"{url.scheme}://{url.netloc}"
+        path = url.path + (f"?{url.query}" if url.query else '')
+
+        with self._host_slot(host):
+            connection, reused = self._take_connection(url)
+            try:
+                connection.request('GET', path or '/', headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                if not reused:
+                    raise
+
+                # The server closed the kept-alive connection in the meantime, so retry on a new connection
+                connection, _ = self._take_connection(url, reuse=False)
+                connection.request('GET', path or '/', headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+
+            if response.will_close:
+                connection.close()
+            else:
+                with self.lock:
+                    self.idle_connections[host].append(connection)
+
+        return Response(host + path, response.status, response.headers, body)
+
+    @contextmanager
+    def _host_slot(self, host: str):
+        with self.lock:
+            semaphore = self.host_semaphores.setdefault(host, threading.BoundedSemaphore(self.max_connections_per_host))
+
+        with semaphore:
+            yield
+
+    def _take_connection(self, url: SplitResult, reuse: bool = True) -> tuple[http.client.HTTPConnection, bool]:
+        host = f"{url.scheme}://{url.netloc}"
+        with self.lock:
+            if reuse and self.idle_connections[host]:
+                return self.idle_connections[host].pop(), True
+
+        connection_type = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        return connection_type(url.netloc, timeout=self.timeout), False
+
+    def close(self) -> None:
+        with self.lock:
+            for connections in self.idle_connections.values():
+                for connection in connections:
+                    connection.close()
+            self.idle_connections.clear()
+
+
+# Shared by all requests of a run, such that connections (and cached responses) are reused
+http_client = HTTPClient(cache=HTTPCache())
+
+# Downloads (metadata and sdists) in the background, such that network and analysis can overlap
+download_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='pyternity-download')
+
+
+def prefetch(function: Callable[[T], R], items: Iterable[T], lookahead: int = 8,
+             executor: Executor = download_executor) -> Iterator[R]:
+    """
+    Same as `map`, but the results of up to `lookahead` next items are already calculated in the background
+    :param function: Function to apply to each item, e.g. a download
+    :param items: Items to apply the function to
+    :param lookahead: Amount of items to process ahead of the item that is returned
+    :param executor: Executor to calculate the results with
+    :return: The results, in the same order as the items
+    """
+    items = iter(items)
+    futures: list[Future[R]] = [executor.submit(function, item) for item in islice(items, lookahead + 1)]
+
+    while futures:
+        future = futures.pop(0)
+        futures += [executor.submit(function, item) for item in islice(items, 1)]
+        yield future.result()
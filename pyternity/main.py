@@ -1,11 +1,28 @@
 import argparse
 import math
-from collections import Counter
-
-from pyternity.plotting import plot_project_signatures, plot_all_projects_signatures
-from pyternity.pypi_crawler import PyPIProject, get_most_popular_projects, get_biggest_projects, Release
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Iterable, Iterator
+from urllib.error import HTTPError
+
+import numpy as np
+import vermin
+
+from pyternity.feature_cache import FeatureCache
+from pyternity.feature_registry import FeatureVector, feature_registry
+from pyternity.features import Budget, FeaturePool, dump_profile
+from pyternity.http_client import http_client, prefetch
+from pyternity.plotting import PLOT_FORMATS, PlotOptions, PlotPool
+from pyternity.pypi_crawler import PyPIProject, Release, get_projects, get_most_popular_projects, get_biggest_projects
+from pyternity.results_store import Manifest, ResultsStore
+from pyternity.sampling import sample_adaptively, sample_releases
+from pyternity.signatures import SignatureGrid, get_project_signatures, top_features
+from pyternity.timings import timings
 from pyternity.utils import *
 
+# Amount of releases of which the sdist is already downloaded, while the current release is analyzed
+PREFETCH_RELEASES = 4
+
 
 def range_int(minimum: int = -math.inf, maximum: int = math.inf):
     def max_int_check(n: str) -> int:
@@ -19,6 +36,13 @@ def range_int(minimum: int = -math.inf, maximum: int = math.inf):
     return max_int_check
 
 
+def positive_float(n: str) -> float:
+    n_float = float(n)
+    if n_float <= 0:
+        raise argparse.ArgumentTypeError("Should be positive")
+    return n_float
+
+
 def parse_arguments():
     parser = argparse.ArgumentParser(description="Calculate modernity signatures for PyPI projects")
 
@@ -40,11 +64,87 @@ def parse_arguments():
                         help="Calculate the signature for given type of releases of the projects "
                              "(leave out to calculate for all releases)")
 
+    parser.add_argument('--sample-releases', type=range_int(minimum=2),
+                        help="Amount of releases per project to analyze at most, the ones closest to evenly spread "
+                             "dates between its first and last release (leave out to analyze all releases)")
+
+    parser.add_argument('--sample-per-quarter', default=False, action='store_true',
+                        help="With this flag, only analyze the last release of each quarter per project")
+
+    parser.add_argument('--max-project-size', type=range_int(minimum=1),
+                        help="MB of sdists to analyze per project at most (according to PyPI), which estimates the "
+                             "time it takes; fewer releases (evenly spread in time) are analyzed of bigger projects")
+
+    parser.add_argument('--adaptive-sampling', type=positive_float, metavar='THRESHOLD',
+                        help="Analyze the first and last release per project, and only analyze the release halfway two "
+                             "analyzed releases when their signatures differ more than the threshold (the fraction of "
+                             "features that moved to other Python versions, from 0 to 1), repeatedly")
+
     parser.add_argument('--re-download-projects', default=False, action='store_true',
                         help="With this flag, all projects are always re-downloaded")
 
+    parser.add_argument('--save-files', default=False, action='store_true',
+                        help="With this flag, the Python files of the releases are stored in the 'corpus' folder "
+                             "(deduplicated per project, and reused next time), instead of only reading them in memory")
+
+    parser.add_argument('--include', action='extend', nargs='+', type=str, default=[], metavar='GLOB',
+                        help="Only analyze the Python files (relative to the root folder of their release) that match "
+                             "any of these globs, e.g. 'src/*' (leave out to analyze all Python files)")
+
+    parser.add_argument('--exclude', action='extend', nargs='+', type=str, default=[], metavar='GLOB',
+                        help="Do not analyze the Python files (relative to the root folder of their release) that "
+                             "match any of these globs, e.g. '*/tests/*' '*/_vendor/*' 'docs/*'")
+
+    parser.add_argument('--max-file-size', type=range_int(minimum=1),
+                        help="KB a Python file may be at most to be analyzed, to skip e.g. huge generated files")
+
+    parser.add_argument('--packages-only', default=False, action='store_true',
+                        help="With this flag, only analyze the files inside the importable packages (and top-level "
+                             "modules) of the releases, found in their root or 'src' folder")
+
     parser.add_argument('--re-calculate-features', default=False, action='store_true',
-                        help="With this flag, ignore the 'results' folder and instead process the PyPI files")
+                        help="With this flag, ignore the stored results and instead process the PyPI files")
+
+    parser.add_argument('--incremental', default=False, action='store_true',
+                        help="With this flag, only re-plot the projects that have new releases (or were analyzed with "
+                             "another Vermin version or config, or plotted with other plot options) since the previous "
+                             "run, or of which the plot failed")
+
+    parser.add_argument('--offline', default=False, action='store_true',
+                        help="With this flag, only use the metadata cached by previous runs, without requesting PyPI")
+
+    parser.add_argument('--plot-format', choices=PLOT_FORMATS, default='svg',
+                        help="Format of the plots, 'npz' and 'csv' only save the data of the plots (default: 'svg')")
+
+    parser.add_argument('--plot-dpi', type=range_int(minimum=1), default=100,
+                        help="Resolution of the plots in raster formats (default: 100)")
+
+    parser.add_argument('--plot-max-releases', type=range_int(minimum=2),
+                        help="Amount of releases per project to plot at most, evenly spread over its releases "
+                             "(leave out to plot all releases)")
+
+    parser.add_argument('--plot-jobs', type=range_int(minimum=1), default=1,
+                        help="Amount of processes to render the plots with, while the analysis continues (default: 1)")
+
+    parser.add_argument('--jobs', type=range_int(minimum=1), default=Config.vermin.processes(),
+                        help="Amount of processes to analyze with, shared by all files and releases that are analyzed "
+                             "at the same time (default: amount of CPUs)")
+
+    parser.add_argument('--profile', default=False, action='store_true',
+                        help="With this flag, also record the AST node count and peak memory of the analysis of each "
+                             "file in 'timings.jsonl' (measuring the memory makes the analysis several times slower)")
+
+    parser.add_argument('--file-time-budget', type=positive_float,
+                        help="Seconds the analysis of a single file may take at most, files that take longer are "
+                             "skipped and reported")
+
+    parser.add_argument('--file-memory-budget', type=range_int(minimum=1),
+                        help="MB of memory the analysis of a single file may use at most, files that use more are "
+                             "skipped and reported (implies --profile)")
+
+    parser.add_argument('--profile-slowest', type=range_int(minimum=1),
+                        help="Analyze the given amount of slowest files again with cProfile once the run is done, and "
+                             "dump their stats to the 'profiles' folder")
 
     # TODO add option to set logging level
 
@@ -54,6 +154,19 @@ def parse_arguments():
 def main():
     args = parse_arguments()
     setup_project()
+    http_client.offline = args.offline
+    plot_options = PlotOptions(args.plot_format, args.plot_dpi, args.plot_max_releases)
+    # Set before anything is analyzed or stored, since the stored results depend on it (see `analyzer_fingerprint`)
+    Config.file_filter = FileFilter(tuple(args.include), tuple(args.exclude),
+                                    args.max_file_size * 1000 if args.max_file_size else None, args.packages_only)
+
+    # Files are only analyzed in profiling mode when asked for, since measuring the memory makes it much slower
+    budget = None
+    if args.profile or args.file_time_budget or args.file_memory_budget:
+        memory_budget = args.file_memory_budget * 1_000_000 if args.file_memory_budget else None
+        budget = Budget(args.file_time_budget, memory_budget)
+
+    max_project_size = args.max_project_size * 1_000_000 if args.max_project_size else None
 
     # Either get nth biggest or nth most popular projects from PyPI
     if args.most_popular_projects:
@@ -72,57 +185,180 @@ def main():
         case _:
             version_check = lambda *_: True
 
-    all_signatures_per_project = []
-    features_count_per_version = defaultdict(Counter)
-
-    for project_name in projects:
-        logger.info(f"Calculating signatures for {project_name} ...")
-        project = PyPIProject(project_name, args.re_download_projects, args.re_calculate_features)
-
-        signatures = {}
+    # Mean signatures of the releases of all projects, added as each project finishes
+    all_projects_grid = SignatureGrid()
+    # Per feature id, how often it was detected in the releases with a signature
+    feature_counts = np.zeros(0, dtype=np.int64)
+    fingerprint = analyzer_fingerprint()
+    # Per project, whether its releases changed since the previous run
+    changed_projects: dict[str, bool] = {}
 
+    def select_releases(project: PyPIProject) -> list[Release]:
         releases = [r for r in project.releases if version_check(r) and r.upload_date <= args.max_release_date]
         logger.info(f"Found {len(releases)} {args.release_type} releases: {', '.join(r.version for r in releases)}")
-        for release in releases:
-            logger.info(f"Calculating signature for {release.project_name} {release.version} ...")
-
-            all_features = release.get_features()
-            features_per_version = {version: sum(features.values()) for version, features in all_features.items()}
-            total_features = sum(features_per_version.values())
-
-            if total_features == 0:
-                logger.info(f"Did not found any features for {release.project_name} {release.version}")
-                continue
-
-            signature = {version: features_per_version[version] / total_features for version in all_features}
-            signatures[release] = signature
 
-            # Log all those features that were detected before its Python version released
-            for version, features in all_features.items():
-                features_count_per_version[version].update(features)
-
-                if features and version not in possible_versions(release.upload_date):
-                    logger.warning(f"Following Python {version} ({PYTHON_RELEASES[version].date()}) features "
-                                   f"should not be able to be detected on {release.upload_date.date()}: \n{features}")
-
-        all_signatures_per_project.append(signatures)
-
-        # Don't render the plot if we (statistically) do not have enough
-        if len(signatures) >= 5:
-            plot_project_signatures(project, signatures)
+        sampled = sample_releases(releases, args.sample_releases, args.sample_per_quarter, max_project_size)
+        if len(sampled) < len(releases):
+            size, total_size = sum(r.size for r in sampled) / 1e6, sum(r.size for r in releases) / 1e6
+            logger.info(f"Sampled {len(sampled)} of them ({size:.1f} of {total_size:.1f} MB of sdists): "
+                        f"{', '.join(r.version for r in sampled)}")
+        return sampled
+
+    def detect_changes(project: PyPIProject, releases: list[Release]) -> None:
+        manifest = results.get_manifest(project.name.lower())
+        changed_projects[project.name] = (
+            args.re_calculate_features or manifest is None or manifest.fingerprint != fingerprint or
+            manifest.releases != {release.version for release in releases} or
+            manifest.plot_options != repr(plot_options)
+        )
+        # Stale releases (calculated with another Vermin version or config) are re-calculated automatically
+        if args.incremental and manifest:
+            new_releases = [release.version for release in releases if release.version not in manifest.releases]
+            logger.info(f"Found {len(new_releases)} new releases since the previous run (of which the latest "
+                        f"release was uploaded on {manifest.last_upload_date}): {', '.join(new_releases)}")
+
+    def release_units(project: PyPIProject, releases: list[Release]) -> Iterator[tuple[PyPIProject, Release]]:
+        for i, release in enumerate(releases):
+            # Already download the next releases, such that they are ready once they are analyzed
+            for next_release in releases[i:i + 1 + PREFETCH_RELEASES]:
+                next_release.prefetch(results)
+
+            yield project, release
+
+    def project_releases(projects: Iterable[PyPIProject]) -> Iterator[tuple[PyPIProject, Release | None]]:
+        """
+        :return: Per project, its selected releases, followed by (project, None) to mark the end of that project
+        """
+        for project in projects:
+            logger.info(f"Calculating signatures for {project.name} ...")
+            releases = select_releases(project)
+            detect_changes(project, releases)
+            yield from release_units(project, releases)
+            yield project, None
+
+    def calculate_features(
+            unit: tuple[PyPIProject, Release | None]
+    ) -> tuple[PyPIProject, Release | None, FeatureVector | None]:
+        project, release = unit
+        if release is None:
+            return project, release, None
+
+        logger.info(f"Calculating signature for {release.project_name} {release.version} ...")
+        try:
+            release_features = release.get_features(results, pool)
+        except HTTPError as e:
+            # In offline mode, a release of which the sdist is needed but not available is skipped, not the whole run
+            if not http_client.is_unavailable_offline(e):
+                raise
+            logger.warning(f"Skipping {release.project_name} {release.version}, its sdist is not available offline")
+            return project, release, None
+
+        return project, release, feature_registry.to_vector(release_features)
+
+    def analyze_projects(
+            projects: Iterable[PyPIProject]
+    ) -> Iterator[tuple[PyPIProject, list[Release], list[FeatureVector]]]:
+        """
+        :return: Per project, its analyzed releases and per such release its features
+        """
+        if args.adaptive_sampling is None:
+            # Releases of the next projects are already analyzed while the releases of a project are completed
+            releases, vectors = [], []
+            for project, release, vector in prefetch(calculate_features, project_releases(projects), args.jobs,
+                                                     release_executor):
+                if release is not None:
+                    # Releases that could not be analyzed are left out
+                    if vector is not None:
+                        releases.append(release)
+                        vectors.append(vector)
+                    continue
+
+                yield project, releases, vectors
+                releases, vectors = [], []
+            return
+
+        # Which releases are analyzed depends on the signatures of the releases before, so projects are analyzed one by
+        # one, while the releases of each round of a project are analyzed at the same time
+        for project in projects:
+            logger.info(f"Calculating signatures for {project.name} ...")
+
+            def analyze(batch: list[Release]) -> list[FeatureVector | None]:
+                units = release_units(project, batch)
+                return [vector for *_, vector in prefetch(calculate_features, units, args.jobs, release_executor)]
+
+            candidates = select_releases(project)
+            releases, vectors = sample_adaptively(candidates, analyze, args.adaptive_sampling)
+            logger.info(f"Adaptive sampling analyzed {len(releases)} of {len(candidates)} releases: "
+                        f"{', '.join(release.version for release in releases)}")
+
+            detect_changes(project, releases)
+            yield project, releases, vectors
+
+    # All releases (of all projects) are analyzed by a single pool of worker processes (and cache with features per
+    # file), while multiple releases are analyzed at the same time, such that small releases also keep it busy.
+    # The results are processed in the same order as the releases, such that these are deterministic.
+    # Plots are rendered by separate processes (created first, before any threads), while the analysis continues.
+    # The time spent in each stage is written to the timings file, and the slowest releases and files are logged.
+    with (
+        timings.open(TIMINGS_FILE, args.profile_slowest or 0),
+        PlotPool(args.plot_jobs, plot_options) as plot_pool,
+        ResultsStore() as results,
+        FeatureCache() as cache,
+        FeaturePool(args.jobs, cache, budget, args.profile) as pool,
+        ThreadPoolExecutor(args.jobs, thread_name_prefix='pyternity-release') as release_executor
+    ):
+        projects = get_projects(projects, args.re_download_projects, args.re_calculate_features, args.save_files)
+        for project, releases, vectors in analyze_projects(projects):
+            # The signatures of all releases of the project are calculated at once
+            project_signatures = get_project_signatures(releases, vectors)
+            all_projects_grid.add(project_signatures)
+            feature_counts = feature_registry.count_features(vectors, feature_counts)
+
+            manifest = Manifest(
+                project.name.lower(), vermin.constants.VERSION, fingerprint,
+                max((release.upload_date for release in releases), default=None),
+                frozenset(release.version for release in releases), repr(plot_options)
+            )
+
+            # Don't render the plot if we (statistically) do not have enough, or when it did not change.
+            # The manifest of a plotted project is only saved once its plot is rendered, such that a plot that failed
+            # (or was not rendered, since the run stopped) is rendered again by the next incremental run.
+            if args.incremental and not changed_projects[project.name]:
+                logger.info(f"No new releases found for {project.name}, keeping its plot")
+            elif len(project_signatures.releases) >= 5:
+                plot_pool.plot_project_signatures(project, project_signatures,
+                                                  partial(results.save_manifest, manifest))
+            else:
+                results.save_manifest(manifest)
+                logger.warning(f"Not enough {args.release_type} releases found for {project.name:30}, "
+                               f"all releases are: {[release.version for release in project.releases]}")
+
+        logger.info(f"In total {feature_counts.sum()} features were detected")
+
+        logger.info("5 most common features detected per Python version:")
+        for version, most_common in top_features(feature_counts, 5).items():
+            logger.info(f"Python {version}: {most_common}")
+
+        if args.incremental and not any(changed_projects.values()):
+            logger.info("No project changed since the previous run, keeping the 'All Projects' plot")
         else:
-            logger.warning(f"Not enough {args.release_type} releases found for {project.name:30}, all releases are: "
-                           f"{[release.version for release in project.releases]}")
+            logger.info("Plotting 'All Projects' plot ...")
+            plot_pool.plot_all_projects_signatures(all_projects_grid)
+
+        if failed_plots := plot_pool.wait():
+            logger.error(f"Failed to plot {len(failed_plots)} plots: {', '.join(failed_plots)}")
 
-    amount_of_features_detected = sum(map(Counter.total, features_count_per_version.values()))
-    logger.info(f"In total {amount_of_features_detected} features were detected")
+        timings.log_summary()
+        logger.info(f"Timings of all stages are written to {TIMINGS_FILE}")
 
-    logger.info("5 most common features detected per Python version:")
-    for version, features_count in features_count_per_version.items():
-        logger.info(f"Python {version}: {features_count.most_common(5)}")
+        if args.profile_slowest:
+            PROFILES_DIR.mkdir(exist_ok=True)
+            for rank, (timing, source) in enumerate(timings.slowest_sources()[:args.profile_slowest], start=1):
+                logger.info(f"Profiling {timing.file} of {timing.project} {timing.release} ...")
+                profile_file = PROFILES_DIR / f"{rank}-{timing.project}-{timing.release}-{Path(timing.file).name}.prof"
+                dump_profile(timing.file, source, profile_file, budget or Budget())
 
-    logger.info("Plotting 'All Projects' plot ...")
-    plot_all_projects_signatures(all_signatures_per_project)
+            logger.info(f"cProfile stats of the {args.profile_slowest} slowest files are dumped to {PROFILES_DIR}")
 
 
 if __name__ == '__main__':
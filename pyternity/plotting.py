@@ -1,4 +1,9 @@
-from itertools import chain
+import csv
+import multiprocessing
+import time
+from multiprocessing.pool import AsyncResult
+from traceback import TracebackException
+from typing import Callable, NamedTuple, Self
 
 import matplotlib
 import matplotlib.dates as mdates
@@ -8,14 +13,51 @@ from matplotlib.axes import Axes
 from matplotlib.figure import FigureBase
 from matplotlib.transforms import Bbox
 from mpl_toolkits.mplot3d import Axes3D
+import numpy as np
 
-from pyternity.pypi_crawler import Release, PyPIProject
+from pyternity.pypi_crawler import PyPIProject
+from pyternity.signatures import ProjectSignatures, SignatureGrid
+from pyternity.timings import Timing, timings
 from pyternity.utils import *
 
 matplotlib.use('Agg')
 
+# Formats that only contain the X/Y/Z grid of a plot, to render it with other tools
+DATA_FORMATS = ('npz', 'csv')
+PLOT_FORMATS = ('svg', 'png', *DATA_FORMATS)
+
+
+class PlotOptions(NamedTuple):
+    file_format: str = 'svg'
+    # Resolution of raster formats (png)
+    dpi: int = 100
+    # Amount of releases per project to plot at most, evenly spread over its releases (None to plot all of them)
+    max_releases: int | None = None
+
+
+def save_grid(X, Y, Z, name: str, file_format: str) -> None:
+    """
+    Save the X/Y/Z grid of a plot, instead of rendering it
+    """
+    if file_format == 'npz':
+        np.savez_compressed(PLOTS_DIR / f"{name}.npz", python_version=X, release_date=Y, signature=Z)
+        return
+
+    python_versions = list(PYTHON_RELEASES)
+    X, Y, Z = np.asarray(X).tolist(), np.asarray(Y).tolist(), np.asarray(Z).tolist()
+    release_dates = {y: mdates.num2date(y).date().isoformat() for y in set(Y)}
+
+    with (PLOTS_DIR / f"{name}.csv").open('w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(('python_version', 'release_date', 'signature'))
+        writer.writerows((python_versions[x], release_dates[y], z) for x, y, z in zip(X, Y, Z))
+
+
+def plot_3d_graph(X, Y, Z, name: str, z_axis_color: str = '', options: PlotOptions = PlotOptions()) -> None:
+    if options.file_format in DATA_FORMATS:
+        save_grid(X, Y, Z, name, options.file_format)
+        return
 
-def plot_3d_graph(X, Y, Z, name: str, z_axis_color: str = '') -> None:
     fig: FigureBase = plt.figure(figsize=(10, 10))
 
     ax: Axes3D = fig.add_subplot(projection='3d')
@@ -42,37 +84,129 @@ def plot_3d_graph(X, Y, Z, name: str, z_axis_color: str = '') -> None:
     }
     ax.plot(list(releases_after_2008), mdates.date2num(list(releases_after_2008.values())), color='red')
 
-    plt.savefig(PLOTS_DIR / f"{name}.svg", bbox_inches=Bbox.from_extents(1.3, 2, 9.9, 7.7), metadata={'Date': ''})
+    # Leave out the date, such that plots only change when their data changes
+    metadata = {'Date': ''} if options.file_format == 'svg' else {}
+    plt.savefig(PLOTS_DIR / f"{name}.{options.file_format}", bbox_inches=Bbox.from_extents(1.3, 2, 9.9, 7.7),
+                dpi=options.dpi, metadata=metadata)
 
     fig.clear()
     plt.close(fig)
 
 
-def get_x_y_z(signatures: dict[Release, Signature]):
-    versions = list(range(len(PYTHON_RELEASES))) * len(signatures)
-    dates = list(chain.from_iterable(
-        [mdates.date2num(release.upload_date)] * len(PYTHON_RELEASES) for release in signatures
-    ))
-    data = list(chain.from_iterable(
-        [signature.get(version, 0) for version in PYTHON_RELEASES] for signature in signatures.values()
-    ))
+def timed_plot_3d_graph(X, Y, Z, name: str, z_axis_color: str = '',
+                        options: PlotOptions = PlotOptions()) -> tuple[float, int]:
+    """
+    Same as `plot_3d_graph`
+    :return: The time it took to plot (in seconds) and the size of the plot file
+    """
+    start = time.perf_counter()
+    plot_3d_graph(X, Y, Z, name, z_axis_color, options)
+    return time.perf_counter() - start, (PLOTS_DIR / f"{name}.{options.file_format}").stat().st_size
+
+
+def get_x_y_z(project_signatures: ProjectSignatures):
+    releases, signatures = project_signatures
+    versions = np.tile(np.arange(len(PYTHON_RELEASES)), len(releases))
+    dates = np.repeat(mdates.date2num([release.upload_date for release in releases]), len(PYTHON_RELEASES))
+    data = signatures.ravel()
 
     return versions, dates, data
 
 
-def plot_project_signatures(project: PyPIProject, signatures: dict[Release, Signature]) -> None:
-    plot_3d_graph(*get_x_y_z(signatures), project.name)
+def decimate(project_signatures: ProjectSignatures, max_releases: int | None) -> ProjectSignatures:
+    """
+    :return: At most max_releases of the signatures, evenly spread over the releases (including the first and last)
+    """
+    releases, signatures = project_signatures
+    if max_releases is None or len(releases) <= max_releases:
+        return project_signatures
+
+    rows = np.unique(np.linspace(0, len(releases) - 1, max_releases).round().astype(int))
+    return ProjectSignatures([releases[row] for row in rows], signatures[rows])
 
 
-def plot_all_projects_signatures(projects: list[dict[Release, dict]]) -> None:
-    all_versions, all_dates, all_data = [], [], []
-    for project in projects:
-        versions, dates, data = get_x_y_z(project)
-        all_versions += versions
-        all_dates += dates
-        all_data += data
+def get_grid_x_y_z(grid: SignatureGrid):
+    bucket_dates, signatures = grid.mean_signatures()
+    versions = np.tile(np.arange(len(PYTHON_RELEASES)), len(bucket_dates))
+    dates = np.repeat(mdates.date2num(bucket_dates.astype(datetime)), len(PYTHON_RELEASES))
+    data = signatures.ravel()
+
+    return versions, dates, data
+
 
-    plot_3d_graph(all_versions, all_dates, all_data, "All Projects", 'lightgrey')
+def plot_project_signatures(project: PyPIProject, project_signatures: ProjectSignatures,
+                            options: PlotOptions = PlotOptions()) -> None:
+    plot_3d_graph(*get_x_y_z(decimate(project_signatures, options.max_releases)), project.name, options=options)
+
+
+def plot_all_projects_signatures(grid: SignatureGrid, options: PlotOptions = PlotOptions()) -> None:
+    plot_3d_graph(*get_grid_x_y_z(grid), "All Projects", 'lightgrey', options)
+
+
+class PlotPool:
+    """
+    Worker processes that render the plots, such that the analysis of the next projects does not wait on it.
+    These are processes, since the Agg backend of matplotlib is not thread-safe.
+    Failed plots are logged per plot (when waiting on them), without stopping the other plots.
+    """
+
+    def __init__(self, processes: int = 1, options: PlotOptions = PlotOptions()):
+        self.options = options
+        self.pool = multiprocessing.Pool(processes)
+        # Per queued plot, its name, its result and what to call once it is rendered
+        self.queued: list[tuple[str, AsyncResult, Callable[[], None] | None]] = []
+
+    def plot_project_signatures(self, project: PyPIProject, project_signatures: ProjectSignatures,
+                                on_plotted: Callable[[], None] | None = None) -> None:
+        """
+        :param on_plotted: Called by `wait` once the plot is rendered successfully, e.g. to save its manifest
+        """
+        # Only the grid is sent to the worker, which is much smaller than the releases
+        grid = get_x_y_z(decimate(project_signatures, self.options.max_releases))
+        self._queue(project.name, grid, on_plotted=on_plotted)
+
+    def plot_all_projects_signatures(self, grid: SignatureGrid) -> None:
+        self._queue("All Projects", get_grid_x_y_z(grid), 'lightgrey')
+
+    def _queue(self, name: str, grid: tuple, z_axis_color: str = '',
+               on_plotted: Callable[[], None] | None = None) -> None:
+        result = self.pool.apply_async(timed_plot_3d_graph, (*grid, name, z_axis_color, self.options))
+        self.queued.append((name, result, on_plotted))
+
+    def wait(self, call_on_plotted: bool = True) -> list[str]:
+        """
+        Wait until all queued plots are rendered, and record the time it took to render each of them
+        :param call_on_plotted: Whether to call the `on_plotted` callbacks of the plots that were rendered successfully
+        :return: Names of the plots that failed
+        """
+        failed = []
+        for name, result, on_plotted in self.queued:
+            try:
+                seconds, size = result.get()
+                timings.record(Timing('plotting', name, None, seconds, size, 1))
+            except Exception as e:
+                failed.append(name)
+                logger.error(f"Error occurred while plotting {name}:\n" +
+                             ''.join(TracebackException.from_exception(e).format()))
+                continue
+
+            if call_on_plotted and on_plotted is not None:
+                on_plotted()
+
+        self.queued.clear()
+        return failed
+
+    def close(self) -> None:
+        # Plots that are still queued (when the run stopped before waiting on them) are not reported as plotted
+        self.wait(call_on_plotted=False)
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
 
 
 def plot_vermin_vs_test_features(vermin_features: dict[str, list[str]], all_test_features: dict[str, set[str]],
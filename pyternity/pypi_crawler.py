@@ -1,13 +1,17 @@
-import json
+import io
 import re
-import shutil
 import tarfile
 import zipfile
-from traceback import TracebackException
-from typing import Any, Iterable, Self
-from urllib import request
+from concurrent.futures import Future
+from operator import attrgetter
+from typing import Any, Callable, Iterable, Iterator, Self, TypeVar
+from urllib.error import HTTPError
 
 from pyternity import features
+from pyternity.corpus import ProjectCorpus
+from pyternity.http_client import http_client, download_executor, prefetch
+from pyternity.results_store import ResultsStore
+from pyternity.timings import timings
 from pyternity.utils import *
 
 # PyPI JSON API reference: https://warehouse.pypa.io/api-reference/json.html
@@ -15,25 +19,70 @@ from pyternity.utils import *
 # which is not yet supported (https://peps.python.org/pep-0700)
 
 PYPI_ENDPOINT = "https://pypi.org"
+TOP_PYPI_PACKAGES_ENDPOINT = "https://raw.githubusercontent.com/hugovk/top-pypi-packages"
 
 # Currently no support for version schemes like 20171021.0 (e.g. home-assistant-frontend)
 MAJOR_VERSION = re.compile(r"\d{1,7}(\.0)*")
 MINOR_VERSION = re.compile(r"\d{1,7}\.\d+(\.0)*")  # Also includes MAJOR_VERSIONS
 
+# Member of a tar or zip file
+Member = TypeVar('Member', tarfile.TarInfo, zipfile.ZipInfo)
+
+
+def read_archive(archive: io.BytesIO, file_filter: FileFilter = FileFilter(),
+                 skipped: Counter[str] | None = None) -> Iterator[SourceFile]:
+    """
+    :param archive: A sdist (tar or zip file)
+    :param file_filter: Files that it skips are not read at all
+    :param skipped: Counts per reason the skipped files
+    :return: Per Python file in the archive, its path within the archive and its contents
+    """
+    skipped = Counter() if skipped is None else skipped
+
+    def filter_members(members: Iterable[Member], path: Callable[[Member], str],
+                       size: Callable[[Member], int]) -> Iterator[Member]:
+        importable = None
+        if file_filter.packages_only:
+            # Which folders are packages is only known once the paths of all Python files are (also of skipped ones)
+            members = list(members)
+            importable = importable_paths(release_path(path(member)) for member in members)
+
+        for member in members:
+            if (reason := file_filter.skip_reason(release_path(path(member)), size(member), importable)) is None:
+                yield member
+            else:
+                skipped[reason] += 1
+
+    if tarfile.is_tarfile(archive):
+        with tarfile.open(fileobj=archive) as tar:
+            members = (member for member in tar if member.isfile() and is_python_file(member.name))
+            for member in filter_members(members, attrgetter('name'), attrgetter('size')):
+                yield member.name, tar.extractfile(member).read()
+    else:
+        with zipfile.ZipFile(archive) as archive_zip:
+            infos = (info for info in archive_zip.infolist() if is_python_file(info.filename))
+            for info in filter_members(infos, attrgetter('filename'), attrgetter('file_size')):
+                yield info.filename, archive_zip.read(info)
+
 
 class Release:
     def __init__(self, project_name: str, version: str, files: list[dict[str, Any]],
-                 re_download: bool, re_calculate: bool):
+                 re_download: bool, re_calculate: bool, save_files: bool = False):
         sdist_file = next(file for file in files if file['packagetype'] == "sdist")
 
         self.project_name = project_name.lower()
         self.version = version
         self.re_download = re_download
         self.re_calculate = re_calculate
+        self.save_files = save_files
         self.filename: str = sdist_file['filename']
         self.requires_python: str = sdist_file['requires_python'] or ''
         self.upload_date = datetime.fromisoformat(sdist_file['upload_time'])
         self.url: str = sdist_file['url']
+        # In bytes, estimates the cost of downloading and analyzing this release
+        self.size: int = sdist_file['size']
+        self.corpus = ProjectCorpus(self.project_name)
+        self.archive: Future[io.BytesIO] | None = None
 
     def is_major(self) -> bool:
         return bool(MAJOR_VERSION.fullmatch(self.version))
@@ -44,83 +93,161 @@ class Release:
     def __lt__(self, other: Self):
         return self.upload_date < other.upload_date
 
-    def download_files(self):
-        out_dir = EXAMPLES_DIR / self.project_name / self.version
-        if out_dir.exists():
-            if not self.re_download:
-                return out_dir
+    def needs_download(self, results: ResultsStore) -> bool:
+        if results.contains(self.project_name, self.version) and not self.re_calculate:
+            return False
+        return not (self.save_files and self.corpus.contains(self.version) and not self.re_download)
 
-            shutil.rmtree(out_dir)
+    def prefetch(self, results: ResultsStore) -> None:
+        """
+        Start downloading the sdist in the background (when it is needed), such that it is ready once it is analyzed
+        :param results: The stored results, the sdist is not needed when this release is already in there
+        """
+        if self.archive is None and self.needs_download(results):
+            self.archive = download_executor.submit(self.download_archive)
 
+    def download_archive(self) -> io.BytesIO:
         logger.info(f"Downloading {self.project_name} {self.version} ...")
-        tmp_file = TMP_DIR / self.filename
-        request.urlretrieve(self.url, tmp_file)
+        with timings.measure('download', self.project_name, self.version) as counts:
+            body = http_client.get(self.url).body
+            counts['bytes'] = len(body)
 
-        # Optimisation: Only keep the Python files
-        if tarfile.is_tarfile(tmp_file):
-            with tarfile.open(tmp_file) as tar:
-                tar.extractall(out_dir, (m for m in tar.getmembers() if is_python_file(m.name)))
-        else:
-            with zipfile.ZipFile(tmp_file) as tmp_zip:
-                tmp_zip.extractall(out_dir, filter(is_python_file, tmp_zip.namelist()))
+        return io.BytesIO(body)
 
-        tmp_file.unlink()
+    def get_archive(self) -> io.BytesIO:
+        """
+        :return: The (prefetched) sdist of this release
+        """
+        if self.archive is None:
+            return self.download_archive()
 
-        return out_dir
+        # Don't keep the archive in memory after it has been used
+        archive, self.archive = self.archive, None
+        with timings.measure('waiting', self.project_name, self.version):
+            return archive.result()
 
-    def get_features(self) -> dict[str, dict[str, int]]:
+    def read_stored_source_files(self) -> Iterator[SourceFile]:
+        """
+        Read the Python files of this release from the corpus of its project,
+        after downloading the sdist and storing its Python files in there (when that was not done yet)
+        :return: Per Python file, its path within the sdist and its contents
+        """
+        if self.re_download or not self.corpus.contains(self.version):
+            archive = self.get_archive()
+
+            # The stored files are counted once they are read
+            with timings.measure('extraction', self.project_name, self.version):
+                # Optimisation: Only keep the Python files (all of these, such that the file filter can be changed)
+                self.corpus.save(self.version, read_archive(archive))
+
+        return self.corpus.read(self.version)
+
+    def read_source_files(self, skipped: Counter[str] | None = None) -> Iterator[SourceFile]:
+        """
+        Download the sdist of this release in memory and read its Python files, without writing anything to disk
+        :param skipped: Counts per reason the files that are not read, since the file filter skips them
+        :return: Per Python file that passes the file filter, its path within the sdist and its contents
         """
-        If features were already calculated before, return that.
-        Else download the source of this release, calculate the features and save this result to file.
+        # Get the archive right away, such that reading the files does not include waiting on the download
+        return read_archive(self.get_archive(), Config.file_filter, skipped)
+
+    def get_features(self, results: ResultsStore,
+                     pool: features.FeaturePool | None = None) -> dict[str, dict[str, int]]:
+        """
+        If features were already calculated before (with the current analyzer fingerprint), return that.
+        Else download the source of this release, calculate the features and save this result to the results store.
+        The Python files are only stored in the corpus of the project when `save_files` is set,
+        else these are read in memory. Only the files that pass the file filter (see `Config.file_filter`) are analyzed.
+        Files of which the analysis fails are skipped and saved as such in the store. When a file exceeded its budget
+        or crashed its worker process, the stored features are incomplete, and the release is re-calculated next time.
+        :param results: The store with the results of all releases
+        :param pool: Pool of workers to calculate the features with (a new one is created when not given)
         :return: Detected Features belonging to this release
         """
-        result_path = RESULTS_DIR / self.project_name / (self.version + '.json')
-        if result_path.exists() and not self.re_calculate:
-            with result_path.open() as result_file:
-                try:
-                    return json.load(result_file)
-                except json.decoder.JSONDecodeError:
-                    # Recalculate if there is an error in the file
-                    # Should only occur when you prematurely exit the program
-                    pass
-
-        download_path = self.download_files()
-
-        try:
-            # Sort features such that it is easier to debug when viewing the files
-            logger.info(f"Getting features from {self.project_name} {self.version} ...")
-            new_sorted_features = sort_features(features.get_features(download_path))
-
-        except (RecursionError, TypeError) as e:
-            # Skip releases that give errors, but do save empty {} to file,
-            # such that we skip it next time we want to plot using the already calculated data
-            new_sorted_features = {}
-            logger.error(f"Error occurred for {self.project_name} {self.version}:\n" +
-                         ''.join(TracebackException.from_exception(e).format()))
-
-        result_path.parent.mkdir(exist_ok=True)
-        with result_path.open('w+') as result_file:
-            json.dump(new_sorted_features, result_file, indent=2)
+        if not self.re_calculate and (stored_features := results.get(self.project_name, self.version)) is not None:
+            return stored_features
+
+        if not self.re_calculate and results.is_stale(self.project_name, self.version):
+            logger.info(f"Stored features of {self.project_name} {self.version} were calculated with another Vermin "
+                        f"version or config, or are incomplete, re-calculating them ...")
+
+        # Per reason, the amount of files that the file filter skipped
+        filtered_files = Counter()
+        if self.save_files:
+            # The corpus contains all Python files of the release, which are filtered once they are read
+            source_files = Config.file_filter.filter(self.read_stored_source_files(), skipped=filtered_files)
+        else:
+            source_files = self.read_source_files(filtered_files)
+        source_files = timings.measure_files('extraction', self.project_name, self.version, source_files)
+
+        # Files that give errors are skipped (and reported), while the features of the other files are still saved
+        skipped_files, retry_files = {}, set()
+
+        def on_analyzed(path: str, source: bytes, profile: features.FileProfile) -> None:
+            timings.record_file(self.project_name, self.version, path, source, profile)
+            if profile.skipped:
+                skipped_files[path] = profile.skipped
+            if profile.retry:
+                retry_files.add(path)
+
+        # Sort features such that it is easier to debug when viewing the results
+        logger.info(f"Getting features from {self.project_name} {self.version} ...")
+        new_sorted_features = sort_features(
+            features.get_features_from_source_files(source_files, pool=pool, on_analyzed=on_analyzed)
+        )
+        if filtered_files:
+            timings.record_filtered(self.project_name, self.version, filtered_files)
+
+        with timings.measure('persistence', self.project_name, self.version):
+            results.save(self.project_name, self.version, new_sorted_features, skipped_files, retry_files)
 
         return new_sorted_features
 
 
 class PyPIProject:
-    def __init__(self, project_name: str, re_download_releases: bool, re_calculate: bool):
-        with request.urlopen(f"{PYPI_ENDPOINT}/pypi/{project_name}/json") as f:
-            meta_data = json.load(f)
+    def __init__(self, project_name: str, re_download_releases: bool, re_calculate: bool, save_files: bool = False):
+        with timings.measure('metadata', project_name.lower()) as counts:
+            response = http_client.get_cached(f"{PYPI_ENDPOINT}/pypi/{project_name}/json")
+            counts['bytes'] = len(response.body)
 
-            self.name = meta_data['info']['name']
+        meta_data = response.json()
 
-            releases = []
-            for version, files in meta_data['releases'].items():
-                try:
-                    releases.append(Release(self.name, version, files, re_download_releases, re_calculate))
-                except StopIteration:
-                    # Not all releases have a sdist file, skip those
-                    continue
+        self.name = meta_data['info']['name']
 
-            self.releases = sorted(releases)
+        releases = []
+        for version, files in meta_data['releases'].items():
+            try:
+                releases.append(Release(self.name, version, files, re_download_releases, re_calculate, save_files))
+            except StopIteration:
+                # Not all releases have a sdist file, skip those
+                continue
+
+        self.releases = sorted(releases)
+
+
+def get_project(project_name: str, re_download_releases: bool, re_calculate: bool,
+                save_files: bool = False) -> PyPIProject | None:
+    """
+    :return: The project, or None when its metadata is not available in offline mode (since it was never cached)
+    """
+    try:
+        return PyPIProject(project_name, re_download_releases, re_calculate, save_files)
+    except HTTPError as e:
+        # A project that is not available offline is skipped, not the whole run
+        if not http_client.is_unavailable_offline(e):
+            raise
+        logger.warning(f"Skipping {project_name}, its metadata is not available offline")
+        return None
+
+
+def get_projects(project_names: Iterable[str], re_download_releases: bool, re_calculate: bool,
+                 save_files: bool = False) -> Iterator[PyPIProject]:
+    """
+    Get the given projects from PyPI, while the next projects are already fetched in the background
+    :return: The projects, in the same order as the given names (without the ones that are not available offline)
+    """
+    projects = prefetch(lambda name: get_project(name, re_download_releases, re_calculate, save_files), project_names)
+    return (project for project in projects if project is not None)
 
 
 def get_biggest_projects(n: int) -> Iterable[str]:
@@ -128,10 +255,8 @@ def get_biggest_projects(n: int) -> Iterable[str]:
     See: https://pypi.org/stats, refreshes each 24 hours. Returns at most 100 biggest projects.
     :return: 100 biggest PyPI projects
     """
-    req = request.Request(f"{PYPI_ENDPOINT}/stats", headers={'accept': 'application/json'})
-    with request.urlopen(req) as f:
-        res = json.load(f)
-        return res['top_packages'].keys()[:n]
+    res = http_client.get_cached(f"{PYPI_ENDPOINT}/stats", headers={'accept': 'application/json'}).json()
+    return list(res['top_packages'])[:n]
 
 
 def get_most_popular_projects(n: int, commit_hash: str) -> Iterable[str]:
@@ -141,7 +266,6 @@ def get_most_popular_projects(n: int, commit_hash: str) -> Iterable[str]:
     :param n: Amount of project to return.
     :return: The n most popular projects (of previous) on PyPI.
     """
-    url = f"https://raw.githubusercontent.com/hugovk/top-pypi-packages/{commit_hash}/top-pypi-packages-30-days.min.json"
-    with request.urlopen(request.Request(url)) as f:
-        res = json.load(f)
-        return (row['project'] for row in res['rows'][:n])
+    url = f"{TOP_PYPI_PACKAGES_ENDPOINT}/{commit_hash}/top-pypi-packages-30-days.min.json"
+    res = http_client.get_cached(url).json()
+    return (row['project'] for row in res['rows'][:n])
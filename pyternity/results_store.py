@@ -0,0 +1,255 @@
+import json
+import sqlite3
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Collection, NamedTuple, Self
+
+import numpy as np
+
+from pyternity.feature_registry import FeatureVector, feature_registry
+from pyternity.utils import *
+
+# Per release version, its sorted features
+ProjectResults: TypeAlias = dict[str, dict[str, dict[str, int]]]
+
+
+class Manifest(NamedTuple):
+    """
+    What a run has seen of a project, such that the next run can determine whether anything changed since then
+    """
+    project: str
+    vermin_version: str
+    fingerprint: str
+    # Upload date of the latest seen release (None when no releases were seen)
+    last_upload_date: datetime | None
+    releases: frozenset[str]
+    # Representation of the plot options of the run (empty for manifests that were saved before these were stored)
+    plot_options: str = ''
+
+
+class ResultsStore:
+    """
+    Stores the detected features of all releases in a single SQLite database, with a row per
+    (project, version, python_version, feature, count). Replaces the JSON file per release in the 'results' folder.
+    The results of a project are loaded in one go, and the most recently used projects are kept in memory as vectors.
+    Each release is stamped with the analyzer fingerprint, results of another fingerprint are stale and not returned.
+    Results with skipped files that may succeed next time (see `FileProfile.retry`) are incomplete, and stale as well.
+    Can be used from multiple threads.
+    """
+
+    def __init__(self, results_file: Path = RESULTS_FILE, projects_in_memory: int = 8):
+        self.fingerprint = analyzer_fingerprint()
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(results_file, check_same_thread=False)
+        self.projects_in_memory = projects_in_memory
+        self.loaded_projects: OrderedDict[str, dict[str, FeatureVector]] = OrderedDict()
+
+        with self.connection:
+            # A release without features (e.g. when an error occurred) is also stored, such that it is skipped next time
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS releases ("
+                "project TEXT, version TEXT, fingerprint TEXT, PRIMARY KEY (project, version))"
+            )
+            columns = [column for _, column, *_ in self.connection.execute("PRAGMA table_info(releases)")]
+            if 'fingerprint' not in columns:
+                # Results stored before they were stamped were calculated with the (pinned) Vermin version of this tool
+                self.connection.execute("ALTER TABLE releases ADD COLUMN fingerprint TEXT")
+                self.connection.execute("UPDATE releases SET fingerprint = ?", (self.fingerprint,))
+
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS features ("
+                "project TEXT, version TEXT, python_version TEXT, feature TEXT, count INTEGER, "
+                "PRIMARY KEY (project, version, python_version, feature)) WITHOUT ROWID"
+            )
+            # Files of which the analysis failed (or exceeded its budget), not part of the features of their release
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS skipped_files ("
+                "project TEXT, version TEXT, path TEXT, reason TEXT, retry INTEGER, "
+                "PRIMARY KEY (project, version, path))"
+            )
+            columns = [column for _, column, *_ in self.connection.execute("PRAGMA table_info(skipped_files)")]
+            if 'retry' not in columns:
+                # Files that raised an error fail the same way again, the others exceeded their budget or crashed
+                self.connection.execute("ALTER TABLE skipped_files ADD COLUMN retry INTEGER")
+                self.connection.execute("UPDATE skipped_files SET retry = reason NOT LIKE 'raised %'")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS manifests ("
+                "project TEXT PRIMARY KEY, vermin_version TEXT, fingerprint TEXT, last_upload_date TEXT, "
+                "releases TEXT, plot_options TEXT)"
+            )
+            columns = [column for _, column, *_ in self.connection.execute("PRAGMA table_info(manifests)")]
+            if 'plot_options' not in columns:
+                # The plots of manifests without plot options are rendered again next time
+                self.connection.execute("ALTER TABLE manifests ADD COLUMN plot_options TEXT")
+
+    def load_vectors(self, project_name: str) -> dict[str, FeatureVector]:
+        """
+        :return: Per stored release of the project, its features as vector
+        """
+        with self.lock:
+            if project_name in self.loaded_projects:
+                self.loaded_projects.move_to_end(project_name)
+                return self.loaded_projects[project_name]
+
+            versions = self.connection.execute(
+                "SELECT version FROM releases WHERE project = ? AND fingerprint = ? AND NOT EXISTS ("
+                "SELECT 1 FROM skipped_files "
+                "WHERE project = releases.project AND version = releases.version AND retry)",
+                (project_name, self.fingerprint)
+            )
+            feature_ids = {version: array('I') for version, in versions}
+            counts = {version: array('I') for version in feature_ids}
+
+            rows = self.connection.execute(
+                "SELECT version, python_version, feature, count FROM features WHERE project = ?", (project_name,)
+            )
+            for version, python_version, feature, count in rows:
+                if version not in feature_ids:
+                    # Stale result
+                    continue
+
+                feature_ids[version].append(feature_registry.intern(python_version, feature))
+                counts[version].append(count)
+
+            project_vectors = {
+                version: FeatureVector(np.array(feature_ids[version], dtype=np.uint32),
+                                       np.array(counts[version], dtype=np.uint32))
+                for version in feature_ids
+            }
+
+            self.loaded_projects[project_name] = project_vectors
+            if len(self.loaded_projects) > self.projects_in_memory:
+                self.loaded_projects.popitem(last=False)
+
+            return project_vectors
+
+    def load_project(self, project_name: str) -> ProjectResults:
+        """
+        :return: Per stored release of the project, its sorted features
+        """
+        return {version: feature_registry.to_features(vector)
+                for version, vector in self.load_vectors(project_name).items()}
+
+    def load_all(self) -> dict[str, ProjectResults]:
+        """
+        :return: Per project, the results of all its stored releases
+        """
+        with self.lock:
+            projects = [project for project, in self.connection.execute("SELECT DISTINCT project FROM releases")]
+
+        return {project: self.load_project(project) for project in projects}
+
+    def get_vector(self, project_name: str, version: str) -> FeatureVector | None:
+        return self.load_vectors(project_name).get(version)
+
+    def get(self, project_name: str, version: str) -> dict[str, dict[str, int]] | None:
+        if (vector := self.get_vector(project_name, version)) is not None:
+            return feature_registry.to_features(vector)
+
+    def contains(self, project_name: str, version: str) -> bool:
+        return self.get_vector(project_name, version) is not None
+
+    def is_stale(self, project_name: str, version: str) -> bool:
+        """
+        :return: Whether the release is stored, but calculated with another analyzer fingerprint or incomplete
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT fingerprint FROM releases WHERE project = ? AND version = ?", (project_name, version)
+            ).fetchone()
+
+        return row is not None and not self.contains(project_name, version)
+
+    def get_skipped_files(self, project_name: str, version: str) -> dict[str, str]:
+        """
+        :return: Per file of the release that was skipped, why it was skipped
+        """
+        with self.lock:
+            return dict(self.connection.execute(
+                "SELECT path, reason FROM skipped_files WHERE project = ? AND version = ?", (project_name, version)
+            ))
+
+    def save(self, project_name: str, version: str, sorted_features: dict[str, dict[str, int]],
+             skipped_files: dict[str, str] | None = None, retry_files: Collection[str] = ()) -> None:
+        """
+        :param skipped_files: Per file of the release that was skipped, why it was skipped
+        :param retry_files: The skipped files that may succeed next time, due to which the release is re-calculated then
+        """
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM features WHERE project = ? AND version = ?", (project_name, version))
+            self.connection.execute("DELETE FROM skipped_files WHERE project = ? AND version = ?",
+                                    (project_name, version))
+            self.connection.execute("INSERT OR REPLACE INTO releases VALUES (?, ?, ?)",
+                                    (project_name, version, self.fingerprint))
+            self.connection.executemany(
+                "INSERT INTO features VALUES (?, ?, ?, ?, ?)",
+                ((project_name, version, python_version, feature, count)
+                 for python_version, features in sorted_features.items() for feature, count in features.items())
+            )
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO skipped_files VALUES (?, ?, ?, ?, ?)",
+                ((project_name, version, path, reason, path in retry_files)
+                 for path, reason in (skipped_files or {}).items())
+            )
+
+            if project_name in self.loaded_projects:
+                if retry_files:
+                    self.loaded_projects[project_name].pop(version, None)
+                else:
+                    self.loaded_projects[project_name][version] = feature_registry.to_vector(sorted_features)
+
+    def get_manifest(self, project_name: str) -> Manifest | None:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT vermin_version, fingerprint, last_upload_date, releases, plot_options FROM manifests "
+                "WHERE project = ?", (project_name,)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        vermin_version, fingerprint, last_upload_date, releases, plot_options = row
+        last_upload_date = datetime.fromisoformat(last_upload_date) if last_upload_date else None
+        return Manifest(project_name, vermin_version, fingerprint, last_upload_date, frozenset(json.loads(releases)),
+                        plot_options or '')
+
+    def save_manifest(self, manifest: Manifest) -> None:
+        last_upload_date = manifest.last_upload_date.isoformat() if manifest.last_upload_date else None
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO manifests VALUES (?, ?, ?, ?, ?, ?)",
+                (manifest.project, manifest.vermin_version, manifest.fingerprint, last_upload_date,
+                 json.dumps(sorted(manifest.releases)), manifest.plot_options)
+            )
+
+    def import_results_dir(self, results_dir: Path = RESULTS_DIR) -> int:
+        """
+        Import the results of the (old) 'results' folder, which contains a JSON file per release.
+        These are stamped with the current analyzer fingerprint, as they were calculated with the pinned Vermin version.
+        :return: Amount of imported releases
+        """
+        result_paths = sorted(results_dir.glob('*/*.json'))
+        for result_path in result_paths:
+            with result_path.open() as result_file:
+                self.save(result_path.parent.name, result_path.name.removesuffix('.json'), json.load(result_file))
+
+        return len(result_paths)
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
+if __name__ == '__main__':
+    # Usage: python -m pyternity.results_store [results_dir]
+    with ResultsStore() as store:
+        amount = store.import_results_dir(Path(sys.argv[1]) if len(sys.argv) > 1 else RESULTS_DIR)
+        print(f"Imported {amount} releases into {RESULTS_FILE}")
@@ -0,0 +1,117 @@
+from typing import Callable, Sequence
+
+import numpy as np
+
+from pyternity.feature_registry import FeatureVector
+from pyternity.pypi_crawler import Release
+from pyternity.signatures import normalize, version_counts
+from pyternity.utils import *
+
+# Analyzes a batch of releases (at the same time), and returns per release its features (None if it can't be analyzed)
+AnalyzeReleases: TypeAlias = Callable[[list[Release]], list[FeatureVector | None]]
+
+
+def sample_evenly_in_time(releases: Sequence[Release], n: int) -> list[Release]:
+    """
+    :param releases: Releases sorted on upload date
+    :return: At most n of the releases, the ones closest to n evenly spread dates (including the first and last release)
+    """
+    if len(releases) <= n:
+        return list(releases)
+
+    dates = np.array([release.upload_date for release in releases], dtype='datetime64[s]').astype(np.int64)
+    targets = np.linspace(dates[0], dates[-1], n)
+
+    # Per target date, the release before or after it, whichever is closer
+    after = np.clip(np.searchsorted(dates, targets), 1, len(dates) - 1)
+    closest = np.where(targets - dates[after - 1] <= dates[after] - targets, after - 1, after)
+    return [releases[row] for row in np.unique(closest).tolist()]
+
+
+def sample_per_quarter(releases: Sequence[Release]) -> list[Release]:
+    """
+    :param releases: Releases sorted on upload date
+    :return: The last release of each quarter in which any release was uploaded
+    """
+    last_releases = {}
+    for release in releases:
+        last_releases[release.upload_date.year, (release.upload_date.month - 1) // 3] = release
+    return list(last_releases.values())
+
+
+def sample_within_size(releases: Sequence[Release], max_size: int) -> list[Release]:
+    """
+    :param releases: Releases sorted on upload date
+    :param max_size: Total size (in bytes) of the sdists of the returned releases at most, which estimates their cost
+    :return: The most releases evenly spread in time (see `sample_evenly_in_time`) of which the sdists fit in max_size
+    """
+    for n in range(len(releases), 0, -1):
+        sampled = sample_evenly_in_time(releases, n)
+        if sum(release.size for release in sampled) <= max_size:
+            return sampled
+    return []
+
+
+def sample_releases(releases: Sequence[Release], max_releases: int | None = None, per_quarter: bool = False,
+                    max_size: int | None = None) -> list[Release]:
+    """
+    :param releases: Releases sorted on upload date
+    :param max_releases: Amount of releases at most, evenly spread in time
+    :param per_quarter: Only keep the last release of each quarter
+    :param max_size: Total size (in bytes) of the sdists at most
+    :return: The sampled releases, sorted on upload date
+    """
+    if per_quarter:
+        releases = sample_per_quarter(releases)
+    if max_releases is not None:
+        releases = sample_evenly_in_time(releases, max_releases)
+    if max_size is not None:
+        releases = sample_within_size(releases, max_size)
+    return list(releases)
+
+
+def signature_distance(first: FeatureVector, second: FeatureVector) -> float:
+    """
+    :return: The fraction of the features that is detected for other Python versions in the signature of the second
+             release than in the first one, from 0 (same signature) to 1 (no Python version in common)
+    """
+    signatures, _ = normalize(version_counts([first, second]))
+    return float(np.abs(signatures[0] - signatures[1]).sum() / 2)
+
+
+def sample_adaptively(releases: Sequence[Release], analyze: AnalyzeReleases,
+                      threshold: float) -> tuple[list[Release], list[FeatureVector]]:
+    """
+    Analyze the first and last release, and then repeatedly the release halfway two neighbouring analyzed releases,
+    but only when the signatures of those differ more than the threshold (see `signature_distance`).
+    All releases that are halfway in a round are analyzed at once. Releases that can't be analyzed are left out,
+    and the release closest to halfway that was not tried yet is taken instead.
+    :param releases: Releases sorted on upload date
+    :param analyze: Analyzes a batch of the releases
+    :param threshold: Signature distance between two neighbouring analyzed releases from which on these are refined
+    :return: The analyzed releases (sorted on upload date), and per such release its features
+    """
+    if not releases:
+        return [], []
+
+    vectors: dict[int, FeatureVector] = {}
+    # Rows of the releases that were tried to be analyzed
+    tried: set[int] = set()
+    rows = sorted({0, len(releases) - 1})
+
+    while rows:
+        tried.update(rows)
+        vectors.update((row, vector) for row, vector in zip(rows, analyze([releases[row] for row in rows]))
+                       if vector is not None)
+
+        # Refine between each two neighbouring analyzed releases that differ too much, by the untried release
+        # closest to halfway them
+        neighbours = sorted(vectors)
+        rows = [
+            min(untried, key=lambda row: abs(row - (start + end) // 2))
+            for start, end in zip(neighbours, neighbours[1:])
+            if (untried := [row for row in range(start + 1, end) if row not in tried])
+            and signature_distance(vectors[start], vectors[end]) > threshold
+        ]
+
+    return [releases[row] for row in sorted(vectors)], [vectors[row] for row in sorted(vectors)]
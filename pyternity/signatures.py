@@ -0,0 +1,149 @@
+from typing import NamedTuple, Sequence
+
+import numpy as np
+
+from pyternity.feature_registry import FeatureRegistry, FeatureVector, feature_registry
+from pyternity.pypi_crawler import Release
+from pyternity.utils import *
+
+PYTHON_RELEASE_DATES = np.array(list(PYTHON_RELEASES.values()), dtype='datetime64[s]')
+
+
+class ProjectSignatures(NamedTuple):
+    """
+    The signatures of (the releases with features of) a project
+    """
+    releases: list[Release]
+    # Per release (row), the fraction of its features per Python version (column)
+    signatures: np.ndarray
+
+
+class SignatureGrid:
+    """
+    The mean signature per date bucket (row) and Python version (column) of all releases added to it.
+    Projects are added one by one, while its size only depends on the date range, not on the amount of releases.
+    """
+
+    # No Python project can be released before this date
+    START = np.datetime64('1990-01', 'M')
+
+    def __init__(self, bucket_months: int = 3):
+        self.bucket_months = bucket_months
+        self.sums = np.zeros((0, len(PYTHON_RELEASES)))
+        # Per bucket, the amount of releases in it
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def add(self, project_signatures: ProjectSignatures) -> None:
+        releases, signatures = project_signatures
+        months = np.array([release.upload_date for release in releases], dtype='datetime64[M]') - self.START
+        buckets = np.maximum(months.astype(np.int64), 0) // self.bucket_months
+
+        if len(buckets) and buckets.max() >= len(self.counts):
+            missing = buckets.max() + 1 - len(self.counts)
+            self.sums = np.pad(self.sums, ((0, missing), (0, 0)))
+            self.counts = np.pad(self.counts, (0, missing))
+
+        np.add.at(self.sums, buckets, signatures)
+        np.add.at(self.counts, buckets, 1)
+
+    def bucket_dates(self) -> np.ndarray:
+        """
+        :return: Per bucket, the date in the middle of it
+        """
+        starts = self.START + np.arange(len(self.counts)) * self.bucket_months
+        return starts.astype('datetime64[D]') + (self.bucket_months * 30) // 2
+
+    def mean_signatures(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        :return: The dates of the non-empty buckets, and per such bucket (row) the mean signature of its releases
+        """
+        filled = self.counts > 0
+        return self.bucket_dates()[filled], self.sums[filled] / self.counts[filled, None]
+
+
+def version_counts(vectors: Sequence[FeatureVector], registry: FeatureRegistry = feature_registry) -> np.ndarray:
+    """
+    :param vectors: Features of a batch of releases, e.g. all releases of a project or of the whole corpus
+    :return: Per release (row) and per Python version (column), the amount of detected features
+    """
+    if not vectors:
+        return np.zeros((0, len(PYTHON_RELEASES)), dtype=np.int64)
+
+    ids = np.concatenate([vector.ids for vector in vectors])
+    counts = np.concatenate([vector.counts for vector in vectors])
+    rows = np.repeat(np.arange(len(vectors)), [len(vector.ids) for vector in vectors])
+    columns = np.array(registry.version_indices, dtype=np.intp)[ids]
+
+    matrix = np.bincount(rows * len(PYTHON_RELEASES) + columns, weights=counts,
+                         minlength=len(vectors) * len(PYTHON_RELEASES))
+    return matrix.reshape(len(vectors), len(PYTHON_RELEASES)).astype(np.int64)
+
+
+def normalize(counts: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    :param counts: Per release and per Python version, the amount of detected features (as returned by `version_counts`)
+    :return: The signature of each release (zeros for a release without features), and the total features per release
+    """
+    totals = counts.sum(axis=1)
+    signatures = np.divide(counts, totals[:, None], out=np.zeros(counts.shape), where=totals[:, None] > 0)
+    return signatures, totals
+
+
+def impossible_versions(counts: np.ndarray, upload_dates: Sequence[datetime]) -> np.ndarray:
+    """
+    :return: Per release and per Python version, whether features were detected that were released after the release
+    """
+    upload_dates = np.array(upload_dates, dtype='datetime64[s]')
+    return (counts > 0) & (PYTHON_RELEASE_DATES[None, :] > upload_dates[:, None])
+
+
+def top_features(feature_counts: np.ndarray, n: int = 5,
+                 registry: FeatureRegistry = feature_registry) -> dict[str, list[tuple[str, int]]]:
+    """
+    :param feature_counts: Per feature id, how often it was detected (as returned by `FeatureRegistry.count_features`)
+    :param n: Amount of features to return per Python version
+    :return: Per Python version, its n most detected features (with ties sorted on name)
+    """
+    detected_ids = np.flatnonzero(feature_counts)
+    versions = np.array(registry.version_indices, dtype=np.intp)[detected_ids]
+    counts = feature_counts[detected_ids]
+    names = np.array([registry.keys[feature_id][1] for feature_id in detected_ids.tolist()], dtype=str)
+
+    order = np.lexsort((names, -counts, versions))
+    versions, detected_ids, counts = versions[order], detected_ids[order], counts[order]
+
+    # The detected features of each Python version are consecutive now, so take the first n of each of them
+    starts = np.searchsorted(versions, np.arange(len(PYTHON_RELEASES)))
+    ends = np.minimum(starts + n, np.searchsorted(versions, np.arange(len(PYTHON_RELEASES)), side='right'))
+    top = {}
+    for python_version, start, end in zip(PYTHON_RELEASES, starts.tolist(), ends.tolist()):
+        top_ids, top_counts = detected_ids[start:end].tolist(), counts[start:end].tolist()
+        top[python_version] = [(registry.keys[feature_id][1], count) for feature_id, count in zip(top_ids, top_counts)]
+
+    return top
+
+
+def get_project_signatures(releases: Sequence[Release], vectors: Sequence[FeatureVector]) -> ProjectSignatures:
+    """
+    Calculate the signatures of all releases of a project at once
+    :param releases: The releases of the project
+    :param vectors: Per release, its features
+    :return: The signatures of the releases in which any feature was detected
+    """
+    counts = version_counts(vectors)
+    signatures, totals = normalize(counts)
+
+    for release in (release for release, total in zip(releases, totals.tolist()) if total == 0):
+        logger.info(f"Did not found any features for {release.project_name} {release.version}")
+
+    # Log all those features that were detected before its Python version released
+    impossible = impossible_versions(counts, [release.upload_date for release in releases])
+    for row, column in np.argwhere(impossible).tolist():
+        release, version = releases[row], list(PYTHON_RELEASES)[column]
+        features = feature_registry.to_features(vectors[row])[version]
+        logger.warning(f"Following Python {version} ({PYTHON_RELEASES[version].date()}) features "
+                       f"should not be able to be detected on {release.upload_date.date()}: \n{features}")
+
+    has_features = totals > 0
+    return ProjectSignatures([release for release, keep in zip(releases, has_features) if keep],
+                             signatures[has_features])
@@ -0,0 +1,221 @@
+import heapq
+import json
+import threading
+import time
+from contextlib import contextmanager
+from itertools import count
+from typing import Iterable, Iterator, NamedTuple, Self, TextIO
+
+from pyternity.features import FileProfile
+from pyternity.utils import *
+
+# Stages of the pipeline, in the order a release goes through them
+STAGES = ('metadata', 'download', 'waiting', 'extraction', 'analysis', 'persistence', 'plotting')
+
+
+class Timing(NamedTuple):
+    """
+    The wall time spent in a stage, for a project (when release is None) or a release (when file is None) or a file
+    """
+    stage: str
+    project: str
+    release: str | None
+    seconds: float
+    bytes: int = 0
+    files: int = 0
+    file: str | None = None
+    # Only measured for files in profiling mode
+    nodes: int | None = None
+    peak_memory: int | None = None
+    # Why the file was skipped, when its analysis failed or exceeded its budget
+    skipped: str | None = None
+
+
+class StageTotals(NamedTuple):
+    seconds: float
+    bytes: int
+    files: int
+
+
+class Timings:
+    """
+    Records the wall time, bytes and files of each stage of the pipeline, per project and release.
+    Each timing is written as a JSON line to the timings file (once opened), while only the totals per stage and per
+    release, and the slowest files, are kept in memory to summarize the run with.
+    The 'waiting' stage is the time the analysis of a release waited on its (prefetched) download.
+    Can be used from multiple threads.
+    """
+
+    def __init__(self, slowest_files: int = 10):
+        self.lock = threading.Lock()
+        self.file: TextIO | None = None
+        self.stage_totals: dict[str, StageTotals] = {stage: StageTotals(0.0, 0, 0) for stage in STAGES}
+        # Per (project, release), the seconds spent per stage
+        self.release_seconds: dict[tuple[str, str], Counter[str]] = defaultdict(Counter)
+        # Heap with the timings of the slowest analyzed files (and their contents, when these are kept)
+        self.slowest_files_amount = slowest_files
+        self.slowest_files_heap: list[tuple[float, int, Timing, bytes | None]] = []
+        self.keep_sources = False
+        # Breaks ties between files that took equally long
+        self.files_counter = count()
+        # Files of which the analysis failed, or exceeded its budget in profiling mode
+        self.skipped_files: list[Timing] = []
+        # Per reason, the amount of files that the file filter skipped (these are never analyzed)
+        self.filtered_files: Counter[str] = Counter()
+
+    def open(self, timings_file: Path = TIMINGS_FILE, profile_slowest: int = 0) -> Self:
+        """
+        Write the timings of this run to the `timings_file` (which is overwritten)
+        :param profile_slowest: Amount of slowest files of which the contents are kept, to profile them afterwards
+        """
+        with self.lock:
+            self.file = timings_file.open('w')
+            self.slowest_files_amount = max(self.slowest_files_amount, profile_slowest)
+            self.keep_sources = profile_slowest > 0
+        return self
+
+    def record(self, timing: Timing, source: bytes | None = None) -> None:
+        """
+        :param source: Contents of the file of the timing, which is kept when it is one of the slowest files
+        """
+        with self.lock:
+            totals = self.stage_totals[timing.stage]
+            self.stage_totals[timing.stage] = StageTotals(totals.seconds + timing.seconds,
+                                                          totals.bytes + timing.bytes, totals.files + timing.files)
+            if timing.release is not None:
+                self.release_seconds[timing.project, timing.release][timing.stage] += timing.seconds
+
+            if timing.file is not None:
+                entry = (timing.seconds, next(self.files_counter), timing, source if self.keep_sources else None)
+                if len(self.slowest_files_heap) < self.slowest_files_amount:
+                    heapq.heappush(self.slowest_files_heap, entry)
+                else:
+                    heapq.heappushpop(self.slowest_files_heap, entry)
+
+            if timing.skipped is not None:
+                self.skipped_files.append(timing)
+
+            if self.file is not None:
+                self.file.write(json.dumps(timing._asdict()) + '\n')
+
+    @contextmanager
+    def measure(self, stage: str, project: str, release: str | None = None) -> Iterator[dict[str, int]]:
+        """
+        Record the wall time of the `with` block
+        :return: Dict in which the block can set the amount of 'bytes' and 'files' it processed
+        """
+        counts = {'bytes': 0, 'files': 0}
+        start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            self.record(Timing(stage, project, release, time.perf_counter() - start, **counts))
+
+    def measure_files(self, stage: str, project: str, release: str | None,
+                      source_files: Iterable[SourceFile]) -> Iterator[SourceFile]:
+        """
+        Record the time spent producing the source files (e.g. reading them from an archive), excluding the time
+        spent by the consumer of them in between
+        """
+        seconds, amount_bytes, amount_files = 0.0, 0, 0
+        source_files = iter(source_files)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    path, source = next(source_files)
+                finally:
+                    seconds += time.perf_counter() - start
+
+                amount_bytes += len(source)
+                amount_files += 1
+                yield path, source
+        except StopIteration:
+            pass
+        finally:
+            self.record(Timing(stage, project, release, seconds, amount_bytes, amount_files))
+
+    def record_file(self, project: str, release: str, path: str, source: bytes, profile: FileProfile) -> None:
+        """
+        Record the analysis of a single file, as reported by `FeaturePool.imap_unordered`
+        """
+        if profile.skipped:
+            logger.warning(f"Skipped {path} of {project} {release}, since its analysis {profile.skipped}")
+
+        self.record(Timing('analysis', project, release, profile.seconds, len(source), 1, path,
+                           profile.nodes, profile.peak_memory, profile.skipped), source)
+
+    def record_filtered(self, project: str, release: str, filtered_files: Counter[str]) -> None:
+        """
+        :param filtered_files: Per reason, the amount of files of the release that the file filter skipped
+        """
+        reasons = ', '.join(f"{amount} {reason}" for reason, amount in sorted(filtered_files.items()))
+        logger.info(f"Filtered {filtered_files.total()} files of {project} {release} ({reasons})")
+        with self.lock:
+            self.filtered_files.update(filtered_files)
+
+    def slowest_releases(self, n: int = 10) -> list[tuple[str, str, Counter[str]]]:
+        """
+        :return: The n releases on which the most time was spent (summed over all stages), with their seconds per stage
+        """
+        with self.lock:
+            slowest = heapq.nlargest(n, self.release_seconds.items(), key=lambda item: item[1].total())
+        return [(project, release, seconds) for (project, release), seconds in slowest]
+
+    def slowest_files(self) -> list[Timing]:
+        """
+        :return: The timings of the slowest analyzed files, slowest first
+        """
+        return [timing for timing, _ in self.slowest_sources()]
+
+    def slowest_sources(self) -> list[tuple[Timing, bytes | None]]:
+        """
+        :return: The timings of the slowest analyzed files and their contents (when these are kept), slowest first
+        """
+        with self.lock:
+            return [(timing, source) for *_, timing, source in sorted(self.slowest_files_heap, reverse=True)]
+
+    def log_summary(self, n: int = 10) -> None:
+        logger.info("Time spent per stage:")
+        for stage, (seconds, amount_bytes, amount_files) in self.stage_totals.items():
+            throughput = f", {amount_bytes / seconds / 1e6:.2f} MB/s" if seconds and amount_bytes else ''
+            logger.info(f"{stage:12} {seconds:10.2f}s, {amount_bytes / 1e6:10.2f} MB, {amount_files:8} files"
+                        f"{throughput}")
+
+        logger.info(f"{n} slowest releases:")
+        for project, release, seconds in self.slowest_releases(n):
+            stages = ', '.join(f"{stage} {seconds[stage]:.2f}s" for stage in STAGES if stage in seconds)
+            logger.info(f"{project} {release}: {seconds.total():.2f}s ({stages})")
+
+        logger.info(f"{self.slowest_files_amount} slowest files:")
+        for timing in self.slowest_files():
+            profile = '' if timing.nodes is None else f", {timing.nodes} nodes"
+            profile += '' if timing.peak_memory is None else f", {timing.peak_memory / 1e6:.1f} MB"
+            logger.info(f"{timing.project} {timing.release} {timing.file}: {timing.seconds:.2f}s, {timing.bytes} bytes"
+                        f"{profile}")
+
+        if self.filtered_files:
+            reasons = ', '.join(f"{amount} {reason}" for reason, amount in sorted(self.filtered_files.items()))
+            logger.info(f"{self.filtered_files.total()} files were filtered ({reasons})")
+
+        if self.skipped_files:
+            logger.warning(f"{len(self.skipped_files)} files were skipped, since their analysis failed or exceeded "
+                           f"its budget:")
+            for timing in self.skipped_files:
+                logger.warning(f"{timing.project} {timing.release} {timing.file}: {timing.skipped}")
+
+    def close(self) -> None:
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
+# Shared by all stages of a run
+timings = Timings()
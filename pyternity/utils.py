@@ -1,11 +1,12 @@
+import hashlib
 import logging
 import sys
 import warnings
-from collections import defaultdict
+from collections import Counter, defaultdict
 from datetime import datetime
-from operator import itemgetter
-from pathlib import Path
-from typing import TypeAlias
+from fnmatch import fnmatchcase
+from pathlib import Path, PurePosixPath
+from typing import Iterable, Iterator, NamedTuple, TypeAlias
 
 import vermin
 from vermin import MOD_REQS, MOD_MEM_REQS, KWARGS_REQS, STRFTIME_REQS, BYTES_REQS, ARRAY_TYPECODE_REQS, \
@@ -13,14 +14,23 @@ from vermin import MOD_REQS, MOD_MEM_REQS, KWARGS_REQS, STRFTIME_REQS, BYTES_REQ
     DICT_UNION_MERGE_SUPPORTED_TYPES, DECORATOR_USER_FUNCTIONS
 
 Features: TypeAlias = defaultdict[str, defaultdict[str, int]]
-Signature: TypeAlias = dict[str, int]
+# Per (Python version, feature), the amount of times it was detected in a single file
+FileFeatures: TypeAlias = Counter[tuple[str, str]]
+# Path of a file and its contents
+SourceFile: TypeAlias = tuple[str, bytes]
 
 ROOT_DIR = Path(__file__).parent.parent
 LOG_FILE = ROOT_DIR / 'pyternity-log.txt'
 TMP_DIR = ROOT_DIR / 'tmp'
 EXAMPLES_DIR = ROOT_DIR / 'examples'
+CORPUS_DIR = ROOT_DIR / 'corpus'
 RESULTS_DIR = ROOT_DIR / 'results'
+RESULTS_FILE = ROOT_DIR / 'results.sqlite'
 PLOTS_DIR = ROOT_DIR / 'plots'
+FEATURE_CACHE_FILE = ROOT_DIR / 'feature-cache.sqlite'
+HTTP_CACHE_DIR = ROOT_DIR / 'http-cache'
+TIMINGS_FILE = ROOT_DIR / 'timings.jsonl'
+PROFILES_DIR = ROOT_DIR / 'profiles'
 
 PYTHON_RELEASES = {version: datetime.fromisoformat(d) for version, d in {
     "2.0": "2000-10-16",
@@ -48,17 +58,124 @@ PYTHON_RELEASES = {version: datetime.fromisoformat(d) for version, d in {
 logger = logging.getLogger('pyternity_logger')
 
 
+# Top-level Python files of a release that are not importable modules of it
+NON_MODULE_FILES = {'setup.py', 'conftest.py'}
+
+
+def release_path(path: str, root: Path | None = None) -> str:
+    """
+    :param root: Folder the path is in, by default the first folder of the path (the root folder of an sdist)
+    :return: The path relative to the root folder of its release, e.g. 'example/utils.py' for
+             'example-1.0/example/utils.py'
+    """
+    if root is not None:
+        return Path(path).relative_to(root).as_posix()
+    return path.split('/', 1)[-1]
+
+
+def importable_paths(paths: Iterable[str]) -> set[str]:
+    """
+    :param paths: Paths of the Python files of a release, relative to its root folder
+    :return: The paths inside the importable packages (folders with an '__init__.py') of the release and its top-level
+             modules, both of which are found in its root or 'src' folder
+    """
+    paths = [PurePosixPath(path) for path in paths]
+    package_dirs = {path.parent for path in paths if path.name == '__init__.py'}
+
+    def is_importable(path: PurePosixPath) -> bool:
+        for base in (PurePosixPath(), PurePosixPath('src')):
+            if base.parts != path.parts[:len(base.parts)]:
+                continue
+
+            top_level = path.parts[len(base.parts):]
+            if len(top_level) == 1 and top_level[0] not in NON_MODULE_FILES:
+                return True
+            if len(top_level) > 1 and base / top_level[0] in package_dirs:
+                return True
+
+        return False
+
+    return {str(path) for path in paths if is_importable(path)}
+
+
+class FileFilter(NamedTuple):
+    """
+    Which Python files of a release are analyzed, by their paths relative to the root folder of the release
+    """
+    # Globs of which a file has to match any, when given (e.g. 'src/*')
+    include: tuple[str, ...] = ()
+    # Globs of which a file may match none (e.g. '*/tests/*', '*/_vendor/*' or 'docs/*')
+    exclude: tuple[str, ...] = ()
+    # In bytes, to skip e.g. huge generated files
+    max_size: int | None = None
+    # Only analyze the files inside the importable packages (and top-level modules) of the release
+    packages_only: bool = False
+
+    def skip_reason(self, path: str, size: int, importable: set[str] | None = None) -> str | None:
+        """
+        :param path: Path relative to the root folder of the release
+        :param importable: The importable paths of the release (see `importable_paths`), from the paths of all its
+                           Python files (also the skipped ones), only needed for `packages_only`
+        :return: Why the file is skipped, or None if it is not
+        """
+        if self.include and not any(fnmatchcase(path, glob) for glob in self.include):
+            return 'not included'
+        if any(fnmatchcase(path, glob) for glob in self.exclude):
+            return 'excluded'
+        if self.max_size is not None and size > self.max_size:
+            return 'too large'
+        if self.packages_only and path not in importable:
+            return 'not in a package'
+        return None
+
+    def filter(self, source_files: Iterable[SourceFile], root: Path | None = None,
+               skipped: Counter[str] | None = None) -> Iterator[SourceFile]:
+        """
+        :param root: Folder the files are in, by default the root folder of an sdist (see `release_path`)
+        :param skipped: Counts per reason the skipped files
+        :return: The source files that are analyzed
+        """
+        skipped = Counter() if skipped is None else skipped
+        importable = None
+        if self.packages_only:
+            # Which folders are packages is only known once all paths are, so the files are collected first
+            source_files = list(source_files)
+            importable = importable_paths(release_path(path, root) for path, _ in source_files)
+
+        for path, source in source_files:
+            if (reason := self.skip_reason(release_path(path, root), len(source), importable)) is None:
+                yield path, source
+            else:
+                skipped[reason] += 1
+
+
 class Config:
     vermin = vermin.Config.parse_file(vermin.Config.detect_config_file())
+    # Which files of each release are analyzed, by default all Python files
+    file_filter = FileFilter()
+
+
+def analyzer_fingerprint(with_file_filter: bool = True) -> str:
+    """
+    :param with_file_filter: Whether the file filter is included, since it changes the features of a release, but not
+                             of a single file
+    :return: Hash of the Vermin version and its config, which changes whenever the detected features may change
+    """
+    # The amount of processes does not influence the detected features
+    config = '\n'.join(line for line in repr(Config.vermin).splitlines() if 'processes' not in line)
+    # Without any filter, the fingerprint stays the same as before filters existed
+    if with_file_filter and Config.file_filter != FileFilter():
+        config += f"\n{Config.file_filter!r}"
+    return hashlib.sha256(f"{vermin.constants.VERSION}\n{config}".encode()).hexdigest()
 
 
 def sort_features(features: Features) -> dict[str, dict[str, int]]:
     """
     :param features: Features to sort
     :return: Return a new dict where features are sorted on version,
-    and within each version it is sorted on how often it occurs (descending)
+    and within each version it is sorted on how often it occurs (descending), and then on name
     """
-    return {py_v: dict(sorted(features[py_v].items(), key=itemgetter(1), reverse=True)) for py_v in PYTHON_RELEASES}
+    return {py_v: dict(sorted(features[py_v].items(), key=lambda f: (-f[1], f[0]))) for py_v in PYTHON_RELEASES}
 
 
 def parse_vermin_version(version: str) -> str | None:
@@ -78,9 +195,9 @@ def setup_project():
 
     # Create missing directories
     TMP_DIR.mkdir(exist_ok=True)
-    EXAMPLES_DIR.mkdir(exist_ok=True)
-    RESULTS_DIR.mkdir(exist_ok=True)
+    CORPUS_DIR.mkdir(exist_ok=True)
     PLOTS_DIR.mkdir(exist_ok=True)
+    HTTP_CACHE_DIR.mkdir(exist_ok=True)
 
     # Setup logger, log normal logs and errors separately
     logger.setLevel(logging.INFO)
@@ -8,6 +8,7 @@ setup(
     install_requires=[
         "vermin==1.5.1",
         "matplotlib==3.6.2",
+        "numpy==1.26.4",
         "Sphinx==4.5.0"
     ],
     python_requires=">=3.11",
@@ -0,0 +1,57 @@
+import unittest
+from tempfile import TemporaryDirectory
+
+from pyternity.corpus import ProjectCorpus, import_examples_dir
+from pyternity.utils import *
+
+
+class TestProjectCorpus(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = TemporaryDirectory()
+        self.corpus_dir = Path(self.directory.name) / 'corpus'
+        self.corpus = ProjectCorpus('example', self.corpus_dir)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_save_and_read(self):
+        release_1 = [('example/__init__.py', b""), ('example/utils.py', b"import zoneinfo\n")]
+        release_2 = [('example/__init__.py', b""), ('example/utils.py', b"import zoneinfo\n"),
+                     ('example/new.py', b"def f(a, /): pass\n")]
+
+        self.assertFalse(self.corpus.contains('1.0'))
+        self.corpus.save('1.0', release_1)
+        self.corpus.save('1.1', release_2)
+
+        self.assertTrue(self.corpus.contains('1.0'))
+        self.assertEqual(list(self.corpus.read('1.0')), release_1)
+        self.assertEqual(list(self.corpus.read('1.1')), release_2)
+        self.assertEqual(list(self.corpus.read('1.2')), [])
+
+        # Each distinct content is only stored once
+        self.assertEqual(self.corpus.blobs_file.stat().st_size, len(b"import zoneinfo\ndef f(a, /): pass\n"))
+
+        # Storing a release again replaces its files
+        self.corpus.save('1.0', release_1[:1])
+        self.assertEqual(list(self.corpus.read('1.0')), release_1[:1])
+
+    def test_empty_files(self):
+        self.corpus.save('1.0', [('example/__init__.py', b"")])
+        self.assertEqual(list(self.corpus.read('1.0')), [('example/__init__.py', b"")])
+
+    def test_read_order(self):
+        # The empty content and the content after it have the same offset, while 'b.py' and 'c.py' share a content
+        self.corpus.save('1.0', [('z.py', b""), ('c.py', b"x = 1\n"), ('b.py', b"x = 1\n"), ('a.py', b"y = 2\n")])
+        self.assertEqual([path for path, _ in self.corpus.read('1.0')], ['z.py', 'b.py', 'c.py', 'a.py'])
+
+    def test_import_examples_dir(self):
+        examples_dir = Path(self.directory.name) / 'examples'
+        (examples_dir / 'example' / '1.0' / 'example').mkdir(parents=True)
+        (examples_dir / 'example' / '1.0' / 'example' / '__init__.py').write_bytes(b"import zoneinfo\n")
+
+        self.assertEqual(import_examples_dir(examples_dir, self.corpus_dir), 1)
+        self.assertEqual(list(self.corpus.read('1.0')), [('example/__init__.py', b"import zoneinfo\n")])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+
+from pyternity.feature_registry import FeatureRegistry
+from pyternity.utils import *
+
+
+class TestFeatureRegistry(unittest.TestCase):
+    def test_vector_round_trip(self):
+        registry = FeatureRegistry()
+        features = sort_features(defaultdict(dict, {
+            '3.5': {"'typing' module": 2}, '3.8': {'positional-only parameters': 3, 'walrus operator': 3}
+        }))
+
+        vector = registry.to_vector(features)
+        self.assertEqual(len(registry), 3)
+        self.assertEqual(registry.to_features(vector), features)
+        self.assertEqual(registry.intern('3.5', "'typing' module"), vector.ids[0])
+        self.assertEqual(registry.version_indices[vector.ids[0]], list(PYTHON_RELEASES).index('3.5'))
+
+    def test_count_features(self):
+        registry = FeatureRegistry()
+        vectors = [
+            registry.to_vector({'3.5': {"'typing' module": 2}}),
+            registry.to_vector({'3.5': {"'typing' module": 1}, '3.9': {"'zoneinfo' module": 4}}),
+            registry.to_vector({}),
+        ]
+
+        counters = registry.to_counters(registry.count_features(vectors))
+        self.assertEqual(counters['3.5'], {"'typing' module": 3})
+        self.assertEqual(counters['3.9'], {"'zoneinfo' module": 4})
+        self.assertEqual(counters['2.7'], {})
+        self.assertEqual(registry.to_counters(registry.count_features([]))['3.5'], {})
+
+
+if __name__ == '__main__':
+    unittest.main()
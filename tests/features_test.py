@@ -0,0 +1,96 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from pyternity import features
+from pyternity.feature_cache import FeatureCache, hash_source
+from pyternity.utils import *
+
+
+class TestFeatureDetection(unittest.TestCase):
+    SOURCES = ["import zoneinfo", "def f(a, /): pass", "not python code (", "x = 1"]
+
+    def test_get_features_from_source(self):
+        self.assertEqual(features.get_features_from_source(self.SOURCES[0]), {'3.9': {"'zoneinfo' module": 1}})
+        self.assertEqual(features.get_features_from_source(self.SOURCES[2]), {})
+
+    def test_get_features_from_sources(self):
+        for processes in (1, 2):
+            with self.subTest(processes=processes):
+                features_per_source = features.get_features_from_sources(self.SOURCES, processes)
+                self.assertEqual(features_per_source, [features.get_features_from_source(s) for s in self.SOURCES])
+                self.assertEqual(features_per_source[1], {'3.8': {'positional-only parameters': 1}})
+
+                profiled = features.get_profiled_features_from_sources(self.SOURCES, processes)
+                self.assertEqual([source_features for source_features, _ in profiled], features_per_source)
+                self.assertTrue(all(profile.seconds > 0 for _, profile in profiled))
+
+    def test_profiling(self):
+        source = b"import zoneinfo\n" + b"x = [i for i in range(10)]\n" * 1000
+
+        file_features, profile = features.profile_source_features('a.py', source)
+        self.assertEqual(file_features, features.get_source_features('a.py', source))
+        self.assertIsNone(profile.skipped)
+        self.assertGreater(profile.nodes, 1000)
+        self.assertGreater(profile.peak_memory, 0)
+
+        for budget in (features.Budget(seconds=1e-6), features.Budget(memory=1000)):
+            with self.subTest(budget):
+                file_features, profile = features.profile_source_features('a.py', source, budget)
+                self.assertIsNone(file_features)
+                self.assertIsNotNone(profile.skipped)
+
+    def test_skipped_files_are_not_cached(self):
+        source_files = [('a.py', b"import zoneinfo\n")]
+        with TemporaryDirectory() as directory, FeatureCache(Path(directory) / 'cache.sqlite') as cache:
+            pool = features.FeaturePool(1, cache, features.Budget(seconds=1e-6))
+            self.assertEqual(list(pool.imap_unordered(source_files)), [Counter()])
+            self.assertIsNone(cache.get(hash_source(source_files[0][1])))
+
+            pool.budget = features.Budget()
+            self.assertEqual(list(pool.imap_unordered(source_files)), [Counter({('3.9', "'zoneinfo' module"): 1})])
+            self.assertIsNotNone(cache.get(hash_source(source_files[0][1])))
+
+    def test_errors_are_contained_per_file(self):
+        # Too deeply nested for the default recursion limit of the visitor, and of the parser
+        for depth in (1000, 3000):
+            with self.subTest(depth):
+                nested_source = b"x = " + b"-" * depth + b"1\nimport zoneinfo\n"
+                _, file_features, profile = features.get_keyed_source_features(('key', 'a.py', nested_source))
+                self.assertEqual(file_features, Counter({('3.9', "'zoneinfo' module"): 1}))
+                self.assertIsNone(profile.skipped)
+
+        source_files = [('a.py', b"import zoneinfo\n"), ('b.py', b"def f(a, /): pass\n")]
+        with mock.patch.object(features, 'get_source_features', side_effect=[Counter({('3.9', 'a'): 1}), TypeError]):
+            analyzed = []
+            detected_features = features.get_features_from_source_files(
+                source_files, processes=1, on_analyzed=lambda path, _, profile: analyzed.append((path, profile))
+            )
+
+        self.assertEqual(detected_features, {'3.9': {'a': 1}})
+        self.assertEqual([(path, profile.skipped, profile.retry) for path, profile in analyzed],
+                         [('a.py', None, False), ('b.py', "raised TypeError: ", False)])
+
+    def test_crashed_workers_are_contained(self):
+        def crash_on(path: str, source: bytes) -> FileFeatures:
+            if source == b"crash":
+                os._exit(1)
+            return Counter({('3.9', path): 1})
+
+        source_files = [('a.py', b"a"), ('b.py', b"crash"), ('c.py', b"c")]
+        analyzed = []
+        # The worker processes are forked, so these use the patched function as well
+        with mock.patch.object(features, 'get_source_features', crash_on), \
+                mock.patch.object(features, 'WORKER_POLL_SECONDS', 0.1):
+            detected_features = features.get_features_from_source_files(
+                source_files, processes=2, on_analyzed=lambda path, _, profile: analyzed.append((path, profile))
+            )
+
+        self.assertEqual(detected_features, {'3.9': {'a.py': 1, 'c.py': 1}})
+        self.assertEqual(sorted((path, profile.skipped, profile.retry) for path, profile in analyzed),
+                         [('a.py', None, False), ('b.py', "crashed its worker process", True), ('c.py', None, False)])
+
+
+if __name__ == '__main__':
+    unittest.main()
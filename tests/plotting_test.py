@@ -0,0 +1,70 @@
+import csv
+import unittest
+from tempfile import TemporaryDirectory
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+
+from pyternity import plotting
+from pyternity.signatures import ProjectSignatures, SignatureGrid
+from pyternity.utils import *
+
+
+class TestPlotting(unittest.TestCase):
+    def setUp(self) -> None:
+        releases = [SimpleNamespace(upload_date=datetime(2010 + i, 1, 1)) for i in range(10)]
+        signatures = np.random.default_rng(0).random((10, len(PYTHON_RELEASES)))
+        self.project_signatures = ProjectSignatures(releases, signatures)
+
+    def test_decimate(self):
+        decimated = plotting.decimate(self.project_signatures, 4)
+        self.assertEqual([release.upload_date.year for release in decimated.releases], [2010, 2013, 2016, 2019])
+        np.testing.assert_array_equal(decimated.signatures, self.project_signatures.signatures[[0, 3, 6, 9]])
+        self.assertIs(plotting.decimate(self.project_signatures, None), self.project_signatures)
+
+    def test_data_formats(self):
+        project = SimpleNamespace(name='example')
+
+        with TemporaryDirectory() as plots_dir, mock.patch.object(plotting, 'PLOTS_DIR', Path(plots_dir)):
+            plotting.plot_project_signatures(project, self.project_signatures, plotting.PlotOptions('npz'))
+            plotting.plot_project_signatures(project, self.project_signatures, plotting.PlotOptions('csv'))
+
+            grid = np.load(Path(plots_dir) / 'example.npz')
+            np.testing.assert_array_equal(grid['signature'], self.project_signatures.signatures.ravel())
+
+            with (Path(plots_dir) / 'example.csv').open() as csv_file:
+                rows = list(csv.reader(csv_file))
+
+        self.assertEqual(len(rows), 1 + 10 * len(PYTHON_RELEASES))
+        self.assertEqual(rows[1][:2], ['2.0', '2010-01-01'])
+        self.assertEqual(rows[-1][:2], [list(PYTHON_RELEASES)[-1], '2019-01-01'])
+
+    def test_plot_pool(self):
+        too_few = ProjectSignatures(self.project_signatures.releases[:1], self.project_signatures.signatures[:1, :1])
+
+        with TemporaryDirectory() as plots_dir, mock.patch.object(plotting, 'PLOTS_DIR', Path(plots_dir)), \
+                plotting.PlotPool(options=plotting.PlotOptions('npz')) as plot_pool:
+            plot_pool.plot_project_signatures(SimpleNamespace(name='example'), self.project_signatures)
+            grid = SignatureGrid()
+            grid.add(self.project_signatures)
+            plot_pool.plot_all_projects_signatures(grid)
+            self.assertEqual(plot_pool.wait(), [])
+            plot_names = sorted(path.name for path in Path(plots_dir).iterdir())
+            self.assertEqual(plot_names, ['All Projects.npz', 'example.npz'])
+
+        # A failing plot is reported, without stopping the other plots
+        with TemporaryDirectory() as plots_dir, mock.patch.object(plotting, 'PLOTS_DIR', Path(plots_dir)), \
+                plotting.PlotPool(options=plotting.PlotOptions('png')) as plot_pool, self.assertLogs(logger, 'ERROR'):
+            plotted = []
+            for name, signatures in (('broken', too_few), ('example', self.project_signatures)):
+                plot_pool.plot_project_signatures(SimpleNamespace(name=name), signatures,
+                                                  lambda name=name: plotted.append(name))
+            self.assertEqual(plot_pool.wait(), ['broken'])
+            self.assertEqual([path.name for path in Path(plots_dir).iterdir()], ['example.png'])
+            # Only plots that were rendered are reported as such
+            self.assertEqual(plotted, ['example'])
+
+
+if __name__ == '__main__':
+    unittest.main()
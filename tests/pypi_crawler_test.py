@@ -0,0 +1,266 @@
+import io
+import json
+import tarfile
+import threading
+import unittest
+import zipfile
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from tempfile import TemporaryDirectory
+from unittest import mock
+from urllib.error import HTTPError
+
+from pyternity import features, pypi_crawler
+from pyternity.corpus import ProjectCorpus
+from pyternity.feature_cache import FeatureCache
+from pyternity.http_client import HTTPCache, HTTPClient, http_client, prefetch
+from pyternity.results_store import ResultsStore
+from pyternity.utils import *
+
+SOURCE_FILES = {
+    'example-1.0/example/__init__.py': b"import zoneinfo\n",
+    'example-1.0/example/utils.py': b"def f(a, /): pass\n",
+    'example-1.0/README.md': b"# Not a Python file",
+}
+
+
+def create_sdists(directory: Path) -> None:
+    with tarfile.open(directory / 'example-1.0.tar.gz', 'w:gz') as tar:
+        for name, source in SOURCE_FILES.items():
+            member = tarfile.TarInfo(name)
+            member.size = len(source)
+            tar.addfile(member, io.BytesIO(source))
+
+    with zipfile.ZipFile(directory / 'example-1.1.zip', 'w') as archive_zip:
+        for name, source in SOURCE_FILES.items():
+            archive_zip.writestr(name, source)
+
+
+def create_meta_data(directory: Path, endpoint: str) -> None:
+    (directory / 'pypi' / 'example').mkdir(parents=True)
+    releases = {
+        version: [{
+            'packagetype': 'sdist', 'filename': filename, 'requires_python': None,
+            'upload_time': upload_time, 'url': f"{endpoint}/{filename}", 'size': (directory / filename).stat().st_size
+        }] for version, filename, upload_time in (
+            ('1.1', 'example-1.1.zip', '2022-02-01T00:00:00'),
+            ('1.0', 'example-1.0.tar.gz', '2022-01-01T00:00:00'),
+        )
+    }
+    releases['0.1'] = [{'packagetype': 'bdist_wheel'}]
+
+    with (directory / 'pypi' / 'example' / 'json').open('w') as f:
+        json.dump({'info': {'name': 'Example'}, 'releases': releases}, f)
+
+
+class KeepAliveHandler(SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Status codes of all handled requests
+    status_codes = []
+
+    def log_request(self, code='-', size='-') -> None:
+        self.status_codes.append(int(code))
+
+    def log_message(self, *_) -> None:
+        pass
+
+
+class TestPyPICrawler(unittest.TestCase):
+    """
+    Tests the fetching of projects against a local HTTP server, which serves fixtures in place of pypi.org
+    """
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.directory = TemporaryDirectory()
+        directory = Path(cls.directory.name)
+
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), partial(KeepAliveHandler, directory=directory))
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.endpoint = f"http://127.0.0.1:{cls.server.server_address[1]}"
+
+        create_sdists(directory)
+        create_meta_data(directory, cls.endpoint)
+
+        # Don't pollute the cache of actual runs
+        cls.cache_patch = mock.patch.object(http_client, 'cache', HTTPCache(directory / 'http-cache'))
+        cls.cache_patch.start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.cache_patch.stop()
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.directory.cleanup()
+
+    def test_project(self):
+        with mock.patch.object(pypi_crawler, 'PYPI_ENDPOINT', self.endpoint):
+            project = pypi_crawler.PyPIProject('example', False, False)
+
+        self.assertEqual(project.name, 'Example')
+        self.assertEqual([release.version for release in project.releases], ['1.0', '1.1'])
+
+    def test_read_source_files(self):
+        with mock.patch.object(pypi_crawler, 'PYPI_ENDPOINT', self.endpoint):
+            project = pypi_crawler.PyPIProject('example', False, True)
+
+        python_files = {name: source for name, source in SOURCE_FILES.items() if is_python_file(name)}
+        results = ResultsStore(Path(self.directory.name) / 'results.sqlite')
+        for release in project.releases:
+            with self.subTest(release.filename):
+                release.prefetch(results)
+                self.assertIsNotNone(release.archive)
+                self.assertEqual(dict(release.read_source_files()), python_files)
+
+                detected_features = features.get_features_from_source_files(python_files.items(), processes=1)
+                self.assertEqual(detected_features['3.8'], {'positional-only parameters': 1})
+                self.assertEqual(detected_features['3.9'], {"'zoneinfo' module": 1})
+
+        results.close()
+
+    def test_read_stored_source_files(self):
+        corpus = partial(ProjectCorpus, corpus_dir=Path(self.directory.name) / 'corpus')
+        with mock.patch.object(pypi_crawler, 'PYPI_ENDPOINT', self.endpoint), \
+                mock.patch.object(pypi_crawler, 'ProjectCorpus', corpus):
+            project = pypi_crawler.PyPIProject('example', False, True, save_files=True)
+
+        python_files = {name: source for name, source in SOURCE_FILES.items() if is_python_file(name)}
+        results = ResultsStore(Path(self.directory.name) / 'results.sqlite')
+        for release in project.releases:
+            with self.subTest(release.filename):
+                self.assertTrue(release.needs_download(results))
+                self.assertEqual(dict(release.read_stored_source_files()), python_files)
+
+                # Next time, the files are read from the corpus
+                self.assertFalse(release.needs_download(results))
+                with mock.patch.object(release, 'get_archive', side_effect=AssertionError):
+                    self.assertEqual(dict(release.read_stored_source_files()), python_files)
+
+        results.close()
+
+    def test_skipped_files_are_analyzed_again(self):
+        with mock.patch.object(pypi_crawler, 'PYPI_ENDPOINT', self.endpoint):
+            release = pypi_crawler.PyPIProject('example', False, False).releases[0]
+
+        directory = Path(self.directory.name)
+        with ResultsStore(directory / 'budget.sqlite') as results, FeatureCache(directory / 'cache.sqlite') as cache, \
+                features.FeaturePool(1, cache, features.Budget(seconds=1e-6)) as pool:
+            self.assertEqual(release.get_features(results, pool)['3.9'], {})
+            self.assertEqual(len(results.get_skipped_files('example', '1.0')), 2)
+            self.assertTrue(results.is_stale('example', '1.0'))
+
+            # Without a budget, the release is re-calculated and the skipped files are analyzed again
+            pool.budget = features.Budget()
+            self.assertEqual(release.get_features(results, pool)['3.9'], {"'zoneinfo' module": 1})
+            self.assertEqual(results.get_skipped_files('example', '1.0'), {})
+            self.assertEqual(results.get('example', '1.0')['3.8'], {'positional-only parameters': 1})
+
+    def test_offline_sdist_is_not_available(self):
+        with mock.patch.object(pypi_crawler, 'PYPI_ENDPOINT', self.endpoint):
+            project = pypi_crawler.PyPIProject('example', False, True)
+
+        results = ResultsStore(Path(self.directory.name) / 'results.sqlite')
+        with mock.patch.object(http_client, 'offline', True):
+            release = project.releases[0]
+            release.prefetch(results)
+            # The download fails in the background, but only the release that needs it is affected
+            with self.assertRaises(HTTPError) as context:
+                release.get_features(results)
+            self.assertEqual(context.exception.code, 504)
+
+        results.close()
+
+    def test_offline_project_is_not_available(self):
+        with TemporaryDirectory() as cache_dir, mock.patch.object(http_client, 'cache', HTTPCache(Path(cache_dir))), \
+                mock.patch.object(pypi_crawler, 'PYPI_ENDPOINT', self.endpoint):
+            pypi_crawler.PyPIProject('example', False, False)
+
+            # Only the metadata of the cached project is available offline, the other project is skipped
+            with mock.patch.object(http_client, 'offline', True):
+                projects = list(pypi_crawler.get_projects(['other', 'example'], False, False))
+            self.assertEqual([project.name for project in projects], ['Example'])
+
+            # Other errors are still raised
+            with self.assertRaises(HTTPError) as context:
+                list(pypi_crawler.get_projects(['other'], False, False))
+            self.assertEqual(context.exception.code, 404)
+
+    def test_read_archive_with_file_filter(self):
+        for filename in ('example-1.0.tar.gz', 'example-1.1.zip'):
+            with self.subTest(filename):
+                archive = io.BytesIO((Path(self.directory.name) / filename).read_bytes())
+                skipped = Counter()
+                file_filter = FileFilter(exclude=('*/utils.py',), max_size=10)
+                self.assertEqual(list(pypi_crawler.read_archive(archive, file_filter, skipped)), [])
+                self.assertEqual(skipped, {'excluded': 1, 'too large': 1})
+
+    def test_file_filter_packages_only(self):
+        source_files = [(f"example-1.0/{path}", b"") for path in (
+            'setup.py', 'six.py', 'docs/conf.py', 'tests/__init__.py', 'tests/test_example.py',
+            'src/example/__init__.py', 'src/example/sub/utils.py', 'src/example/data/script.py', 'src/module.py'
+        )]
+        skipped = Counter()
+        file_filter = FileFilter(exclude=('tests/*',), packages_only=True)
+        self.assertEqual([path for path, _ in file_filter.filter(source_files, skipped=skipped)], [
+            'example-1.0/six.py', 'example-1.0/src/example/__init__.py', 'example-1.0/src/example/sub/utils.py',
+            'example-1.0/src/example/data/script.py', 'example-1.0/src/module.py'
+        ])
+        self.assertEqual(skipped, {'excluded': 2, 'not in a package': 2})
+
+    def test_packages_of_skipped_files(self):
+        # A package of which the '__init__.py' is skipped is still a package, also when the files are read in memory
+        source_files = {'ex-1.0/pkg/__init__.py': b"x = 1\n" * 100, 'ex-1.0/pkg/mod.py': b"x = 1\n"}
+        tar_file = io.BytesIO()
+        with tarfile.open(fileobj=tar_file, mode='w:gz') as tar:
+            for name, source in source_files.items():
+                member = tarfile.TarInfo(name)
+                member.size = len(source)
+                tar.addfile(member, io.BytesIO(source))
+
+        file_filter = FileFilter(max_size=100, packages_only=True)
+        tar_file.seek(0)
+        skipped = Counter()
+        self.assertEqual([path for path, _ in pypi_crawler.read_archive(tar_file, file_filter, skipped)],
+                         ['ex-1.0/pkg/mod.py'])
+        self.assertEqual(skipped, {'too large': 1})
+        self.assertEqual([path for path, _ in file_filter.filter(source_files.items())], ['ex-1.0/pkg/mod.py'])
+
+    def test_get_projects_keeps_order(self):
+        with mock.patch.object(pypi_crawler, 'PYPI_ENDPOINT', self.endpoint):
+            projects = list(pypi_crawler.get_projects(['example'] * 10, False, False))
+
+        self.assertEqual([project.name for project in projects], ['Example'] * 10)
+        self.assertEqual(list(prefetch(lambda x: x * 2, range(20), lookahead=3)), list(range(0, 40, 2)))
+
+    def test_connections_are_reused(self):
+        client = HTTPClient(max_connections_per_host=2)
+        for _ in range(5):
+            self.assertEqual(client.get(f"{self.endpoint}/pypi/example/json").status, 200)
+
+        self.assertEqual(len(client.idle_connections[self.endpoint]), 1)
+        client.close()
+
+    def test_cached_responses_are_revalidated(self):
+        url = f"{self.endpoint}/pypi/example/json"
+
+        with TemporaryDirectory() as cache_dir:
+            client = HTTPClient(cache=HTTPCache(Path(cache_dir)))
+            KeepAliveHandler.status_codes.clear()
+
+            first = client.get_cached(url)
+            second = client.get_cached(url)
+            self.assertEqual(KeepAliveHandler.status_codes, [200, 304])
+            self.assertEqual(first.json(), second.json())
+
+            # In offline mode, cached responses are served without requesting them
+            client.offline = True
+            self.assertEqual(client.get_cached(url).json()['info']['name'], 'Example')
+            self.assertEqual(KeepAliveHandler.status_codes, [200, 304])
+            with self.assertRaises(HTTPError):
+                client.get_cached(f"{self.endpoint}/pypi/other/json")
+
+            client.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
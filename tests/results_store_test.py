@@ -0,0 +1,114 @@
+import json
+import sqlite3
+import unittest
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from pyternity.results_store import Manifest, ResultsStore
+from pyternity.utils import *
+
+
+class TestResultsStore(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = TemporaryDirectory()
+        self.store = ResultsStore(Path(self.directory.name) / 'results.sqlite')
+
+    def tearDown(self) -> None:
+        self.store.close()
+        self.directory.cleanup()
+
+    def test_save_and_load(self):
+        release_features = sort_features(defaultdict(dict, {
+            '2.7': {"'argparse' module": 2}, '3.2': {"'argparse' module": 2, "'concurrent' module": 1}
+        }))
+        self.store.save('example', '1.0', release_features)
+        self.store.save('example', '1.1', {})
+
+        # Also check the results when they are not in memory
+        self.store.loaded_projects.clear()
+        self.assertEqual(self.store.get('example', '1.0'), release_features)
+        self.assertEqual(list(self.store.get('example', '1.0')['3.2']), ["'argparse' module", "'concurrent' module"])
+        self.assertEqual(self.store.get('example', '1.1'), {py_v: {} for py_v in PYTHON_RELEASES})
+        self.assertIsNone(self.store.get('example', '1.2'))
+        self.assertEqual(list(self.store.load_all()), ['example'])
+
+    def test_skipped_files(self):
+        self.store.save('example', '1.0', {'3.9': {"'zoneinfo' module": 1}}, {'a.py': "raised TypeError: "})
+        self.assertEqual(self.store.get_skipped_files('example', '1.0'), {'a.py': "raised TypeError: "})
+        self.assertEqual(self.store.get('example', '1.0')['3.9'], {"'zoneinfo' module": 1})
+
+        self.store.save('example', '1.0', {'3.9': {"'zoneinfo' module": 1}})
+        self.assertEqual(self.store.get_skipped_files('example', '1.0'), {})
+
+    def test_incomplete_results(self):
+        # Files that exceeded their budget (or crashed their worker process) may succeed next time
+        self.store.load_vectors('example')
+        self.store.save('example', '1.0', {}, {'a.py': "took more than 1s", 'b.py': "raised TypeError: "}, {'a.py'})
+        for loaded in (True, False):
+            with self.subTest(loaded=loaded):
+                if not loaded:
+                    self.store.loaded_projects.clear()
+                self.assertIsNone(self.store.get('example', '1.0'))
+                self.assertFalse(self.store.contains('example', '1.0'))
+                self.assertTrue(self.store.is_stale('example', '1.0'))
+
+        self.store.save('example', '1.0', {}, {'b.py': "raised TypeError: "})
+        self.assertTrue(self.store.contains('example', '1.0'))
+        self.assertFalse(self.store.is_stale('example', '1.0'))
+
+    def test_skipped_files_migration(self):
+        path = Path(self.directory.name) / 'old.sqlite'
+        with sqlite3.connect(path) as connection:
+            connection.execute("CREATE TABLE releases (project TEXT, version TEXT, fingerprint TEXT)")
+            connection.execute("CREATE TABLE skipped_files (project TEXT, version TEXT, path TEXT, reason TEXT)")
+            connection.executemany("INSERT INTO releases VALUES ('example', ?, ?)",
+                                   [('1.0', self.store.fingerprint), ('1.1', self.store.fingerprint)])
+            connection.executemany("INSERT INTO skipped_files VALUES ('example', ?, 'a.py', ?)",
+                                   [('1.0', "took more than 1s"), ('1.1', "raised TypeError: ")])
+        connection.close()
+
+        with ResultsStore(path) as store:
+            self.assertTrue(store.is_stale('example', '1.0'))
+            self.assertTrue(store.contains('example', '1.1'))
+
+    def test_stale_results(self):
+        self.store.save('example', '1.0', {'3.9': {"'zoneinfo' module": 1}})
+        self.assertFalse(self.store.is_stale('example', '1.0'))
+
+        # Another Vermin version or config gives another fingerprint
+        with mock.patch('pyternity.results_store.analyzer_fingerprint', return_value='other'):
+            other_store = ResultsStore(Path(self.directory.name) / 'results.sqlite')
+
+        self.assertIsNone(other_store.get('example', '1.0'))
+        self.assertTrue(other_store.is_stale('example', '1.0'))
+        self.assertFalse(other_store.is_stale('example', '1.1'))
+
+        other_store.save('example', '1.0', {'3.8': {'walrus operator': 1}})
+        self.assertEqual(other_store.get('example', '1.0')['3.8'], {'walrus operator': 1})
+        self.assertFalse(other_store.is_stale('example', '1.0'))
+        other_store.close()
+
+    def test_manifest(self):
+        self.assertIsNone(self.store.get_manifest('example'))
+
+        manifest = Manifest('example', '1.5.1', analyzer_fingerprint(), datetime(2022, 2, 1), frozenset({'1.0', '1.1'}),
+                            "PlotOptions(file_format='svg', dpi=100, max_releases=None)")
+        self.store.save_manifest(manifest)
+        self.assertEqual(self.store.get_manifest('example'), manifest)
+
+        empty_manifest = manifest._replace(last_upload_date=None, releases=frozenset())
+        self.store.save_manifest(empty_manifest)
+        self.assertEqual(self.store.get_manifest('example'), empty_manifest)
+
+    def test_import_results_dir(self):
+        results_dir = Path(self.directory.name) / 'results'
+        (results_dir / 'example').mkdir(parents=True)
+        with (results_dir / 'example' / '1.0.0.json').open('w') as f:
+            json.dump({'3.9': {"'zoneinfo' module": 1}}, f)
+
+        self.assertEqual(self.store.import_results_dir(results_dir), 1)
+        self.assertEqual(self.store.get('example', '1.0.0')['3.9'], {"'zoneinfo' module": 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
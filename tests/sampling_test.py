@@ -0,0 +1,74 @@
+import unittest
+from types import SimpleNamespace
+
+from pyternity.feature_registry import feature_registry
+from pyternity.sampling import sample_adaptively, sample_evenly_in_time, sample_per_quarter, sample_releases, \
+    sample_within_size, signature_distance
+from pyternity.utils import *
+
+
+def create_releases(*upload_dates: str, size: int = 1000) -> list[SimpleNamespace]:
+    return [SimpleNamespace(version=str(i), upload_date=datetime.fromisoformat(upload_date), size=size)
+            for i, upload_date in enumerate(upload_dates)]
+
+
+def versions(releases) -> list[str]:
+    return [release.version for release in releases]
+
+
+class TestSampling(unittest.TestCase):
+    def test_sample_evenly_in_time(self):
+        # Many patch releases in 2020 should not crowd out the releases of the other years
+        releases = create_releases('2019-01-01', '2020-01-01', '2020-01-02', '2020-01-03', '2020-01-04',
+                                   '2021-01-01', '2023-01-01')
+        self.assertEqual(versions(sample_evenly_in_time(releases, 3)), ['0', '5', '6'])
+        self.assertEqual(versions(sample_evenly_in_time(releases, 5)), ['0', '1', '5', '6'])
+        self.assertEqual(sample_evenly_in_time(releases, 10), releases)
+
+    def test_sample_per_quarter(self):
+        releases = create_releases('2020-01-01', '2020-03-31', '2020-04-01', '2021-02-01')
+        self.assertEqual(versions(sample_per_quarter(releases)), ['1', '2', '3'])
+
+    def test_sample_within_size(self):
+        releases = create_releases('2020-01-01', '2020-02-01', '2020-03-01', '2020-04-01', '2020-05-01')
+        self.assertEqual(versions(sample_within_size(releases, 3000)), ['0', '2', '4'])
+        self.assertEqual(sample_within_size(releases, 500), [])
+        self.assertEqual(versions(sample_releases(releases, max_releases=2, max_size=10_000)), ['0', '4'])
+
+    def test_sample_adaptively(self):
+        old = feature_registry.to_vector({'3.5': {"'typing' module": 1}})
+        new = feature_registry.to_vector({'3.8': {'positional-only parameters': 1}})
+        self.assertEqual(signature_distance(old, old), 0)
+        self.assertEqual(signature_distance(old, new), 1)
+
+        # The features change from release 5 on
+        releases = create_releases(*(f"2020-01-{day:02}" for day in range(1, 10)))
+        batches = []
+
+        def analyze(batch):
+            batches.append(versions(batch))
+            return [old if int(release.version) < 5 else new for release in batch]
+
+        analyzed, vectors = sample_adaptively(releases, analyze, 0.5)
+        self.assertEqual(batches, [['0', '8'], ['4'], ['6'], ['5']])
+        self.assertEqual(versions(analyzed), ['0', '4', '5', '6', '8'])
+        self.assertEqual(vectors, [old, old, new, new, new])
+
+        self.assertEqual(sample_adaptively([], analyze, 0.5), ([], []))
+
+        # Releases that can't be analyzed are left out, and the closest untried release is analyzed instead
+        batches.clear()
+        unavailable = {'4', '5'}
+
+        def analyze_available(batch):
+            return [None if release.version in unavailable else vector
+                    for release, vector in zip(batch, analyze(batch))]
+
+        analyzed, vectors = sample_adaptively(releases, analyze_available, 0.5)
+        self.assertEqual(batches, [['0', '8'], ['4'], ['3'], ['5'], ['6']])
+        self.assertEqual(versions(analyzed), ['0', '3', '6', '8'])
+        self.assertEqual(vectors, [old, old, new, new])
+
+
+if __name__ == '__main__':
+    unittest.main()
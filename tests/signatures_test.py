@@ -0,0 +1,75 @@
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+
+from pyternity.feature_registry import FeatureRegistry, feature_registry
+from pyternity.signatures import ProjectSignatures, SignatureGrid, get_project_signatures, normalize, top_features, \
+    version_counts
+from pyternity.utils import *
+
+
+class TestSignatures(unittest.TestCase):
+    def test_version_counts_and_normalize(self):
+        registry = FeatureRegistry()
+        vectors = [
+            registry.to_vector({'3.5': {"'typing' module": 3}, '3.8': {'positional-only parameters': 1}}),
+            registry.to_vector({}),
+            registry.to_vector({'3.8': {'positional-only parameters': 2, 'walrus operator': 2}}),
+        ]
+
+        counts = version_counts(vectors, registry)
+        self.assertEqual(counts.shape, (3, len(PYTHON_RELEASES)))
+        self.assertEqual(counts[0, list(PYTHON_RELEASES).index('3.5')], 3)
+        self.assertEqual(counts[2, list(PYTHON_RELEASES).index('3.8')], 4)
+
+        signatures, totals = normalize(counts)
+        self.assertEqual(totals.tolist(), [4, 0, 4])
+        self.assertAlmostEqual(signatures[0, list(PYTHON_RELEASES).index('3.5')], 0.75)
+        self.assertEqual(signatures[1].sum(), 0)
+        self.assertAlmostEqual(signatures[2].sum(), 1)
+
+    def test_top_features(self):
+        registry = FeatureRegistry()
+        vector = registry.to_vector({
+            '3.5': {"'typing' module": 1, "'zipapp' module": 5, "'math.inf' member": 5},
+            '3.8': {'walrus operator': 2},
+        })
+
+        top = top_features(registry.count_features([vector]), 2, registry)
+        self.assertEqual(top['3.5'], [("'math.inf' member", 5), ("'zipapp' module", 5)])
+        self.assertEqual(top['3.8'], [('walrus operator', 2)])
+        self.assertEqual(top['3.9'], [])
+
+    def test_get_project_signatures(self):
+        releases = [
+            SimpleNamespace(project_name='example', version=version, upload_date=datetime(2021, 1, 1))
+            for version in ('1.0', '1.1')
+        ]
+        vectors = [feature_registry.to_vector({'3.9': {"'zoneinfo' module": 1}}), feature_registry.to_vector({})]
+
+        with self.assertLogs(logger, 'INFO') as logs:
+            project_signatures = get_project_signatures(releases, vectors)
+
+        self.assertEqual(project_signatures.releases, releases[:1])
+        np.testing.assert_array_equal(project_signatures.signatures.sum(axis=1), [1])
+        self.assertIn("Did not found any features for example 1.1", logs.output[0])
+
+    def test_signature_grid(self):
+        grid = SignatureGrid(bucket_months=12)
+        first_signatures, second_signatures, third_signatures = np.eye(3, len(PYTHON_RELEASES))
+        grid.add(ProjectSignatures(
+            [SimpleNamespace(upload_date=datetime(2020, month, 1)) for month in (1, 6)],
+            np.array([first_signatures, second_signatures])
+        ))
+        grid.add(ProjectSignatures([SimpleNamespace(upload_date=datetime(2022, 3, 1))], np.array([third_signatures])))
+        grid.add(ProjectSignatures([], np.zeros((0, len(PYTHON_RELEASES)))))
+
+        dates, signatures = grid.mean_signatures()
+        self.assertEqual(dates.astype('datetime64[Y]').astype(str).tolist(), ['2020', '2022'])
+        np.testing.assert_array_equal(signatures, [(first_signatures + second_signatures) / 2, third_signatures])
+        self.assertEqual(grid.counts.sum(), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,6 @@
 import multiprocessing
 import pickle
 import re
-from functools import reduce
 from itertools import chain
 
 import docutils.nodes
@@ -26,6 +25,16 @@ HAS_NEW_PARAMETER = re.compile(
 )
 
 
+def generate_ranked_test_cases(job: tuple[int, str, Path]) -> tuple[int, dict[str, Features]]:
+    """
+    Same as `generate_test_cases`, but takes a single argument, such that it can be used with `imap_unordered`
+    :param job: The rank of the doctree, followed by the arguments of `generate_test_cases`
+    :return: The rank of the doctree and its test cases
+    """
+    rank, *arguments = job
+    return rank, generate_test_cases(*arguments)
+
+
 def generate_test_cases(out_dir: str, doctree_file: Path) -> dict[str, Features]:
     # Load the cached doctree (Sphinx caches this automatically after (the first) doctree build)
     with doctree_file.open('rb') as f:
@@ -195,10 +204,23 @@ def build_finished(app: Sphinx, _):
     # We are only interested in the library documentation
     library_doctrees_dir = Path(app.doctreedir) / 'library'
 
-    with multiprocessing.Pool(processes=app.parallel) as pool:
-        new_test_cases = pool.starmap(generate_test_cases, ((app.outdir, p) for p in library_doctrees_dir.iterdir()))
-        test_cases = reduce(dict.__ior__, new_test_cases)
-        save_test_cases(app.config['pyternity_test_cases_file'], test_cases)
+    # The rank of a doctree is its position in name order, which decides which test case wins when there are duplicates
+    doctree_files = list(enumerate(sorted(library_doctrees_dir.iterdir())))
+    # Schedule the largest doctrees first, such that no worker is still busy with a large one when the others are done
+    doctree_files.sort(key=lambda ranked: ranked[1].stat().st_size, reverse=True)
+
+    # Per code, the rank of the doctree it came from and its expected features
+    test_cases: dict[str, tuple[int, Features]] = {}
+    with multiprocessing.Pool(processes=max(app.parallel, 1)) as pool:
+        jobs = ((rank, app.outdir, p) for rank, p in doctree_files)
+        # Merge the test cases of a doctree as soon as it is done, instead of keeping those of all doctrees in memory
+        for rank, new_test_cases in pool.imap_unordered(generate_ranked_test_cases, jobs):
+            for code, expected in new_test_cases.items():
+                if code not in test_cases or rank < test_cases[code][0]:
+                    test_cases[code] = (rank, expected)
+
+    save_test_cases(app.config['pyternity_test_cases_file'],
+                    {code: expected for code, (_, expected) in test_cases.items()})
 
 
 def setup(app: Sphinx) -> dict:
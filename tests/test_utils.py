@@ -1,16 +1,21 @@
+import hashlib
+import inspect
 import json
 import shutil
 import sys
 import tarfile
 import unittest
-from collections import defaultdict
+from collections import Counter, defaultdict
 from pathlib import Path
 from typing import Mapping
 from urllib import request
-from uuid import uuid4
+
+import vermin
 
 from pyternity import features
-from pyternity.utils import TMP_DIR, Features, ROOT_DIR, logger
+from pyternity.plotting import plot_vermin_vs_test_features
+from pyternity.utils import TMP_DIR, Config, Features, ROOT_DIR, analyzer_fingerprint, logger, \
+    vermin_rules_per_python_version
 
 PYTHON_2_VERSION = '2.7.18'
 PYTHON_3_VERSION = f"3.{sys.version_info.minor}.{sys.version_info.micro}"
@@ -19,11 +24,21 @@ TESTS_DIR = ROOT_DIR / 'tests'
 TEST_CASES_FILE_PY2 = TESTS_DIR / 'generated_test_cases_py2.json'
 TEST_CASES_FILE_PY3 = TESTS_DIR / 'generated_test_cases_py3.json'
 TEST_CASES_FILE_OVERWRITES = TESTS_DIR / 'generated_test_cases_overwrites.json'
+VALIDATION_REPORT_FILE = TESTS_DIR / 'vermin_validation_report.json'
+# Files that determine which test cases are generated from the Python documentation
+TEST_CASES_GENERATOR_FILES = (TESTS_DIR / 'generate_test_cases.py', TESTS_DIR / 'sphinx_extension.py')
+
+
+def sorted_features(fts: Features) -> dict[str, dict[str, int]]:
+    return {version: dict(sorted(version_features.items())) for version, version_features in sorted(fts.items())}
 
 
 def msg_features(code: str, actual: Features, expected: Features):
-    sorting = lambda d: {k: dict(sorted(v.items())) for k, v in sorted(d.items())}
-    return f"\n\n{code=!r}\n --> Actual: {sorting(actual)}\n --> Expect: {sorting(expected)}"
+    return f"\n\n{code=!r}\n --> Actual: {sorted_features(actual)}\n --> Expect: {sorted_features(expected)}"
+
+
+def newest_version(fts: Features) -> str:
+    return max(fts.keys(), key=lambda version: tuple(map(int, version.split('.'))))
 
 
 def test_code(test_case: unittest.TestCase, code: str, test_result: Features):
@@ -37,17 +52,81 @@ def get_features_from_test_code(code: str) -> Features:
     :param code: String with the code
     :return: The detected features
     """
-    # Note: tempfile.NamedTemporaryFile cannot be used here, since Vermin reopens the file
-    # Do make the file name random, such that this function can be called concurrently
-    tmp_file = TMP_DIR / f"{uuid4()}.py"
+    # Only use this process for detecting features, since this function itself is already called in a subprocess
+    return features.get_features_from_source(code)
+
+
+def validate_test_cases(test_cases: Mapping[str, Features], processes: int = Config.vermin.processes()) -> dict:
+    """
+    Detect the features of all test cases at once (see `features.get_profiled_features_from_sources`)
+    :param test_cases: Per test case, its code and expected features
+    :param processes: Amount of processes to use
+    :return: The validation report, with the results of all test cases (sorted on code), including how long the
+    detection of each test case took, and why it was skipped when the detection raised an error (or crashed)
+    """
+    codes = sorted(test_cases)
+    cases = [{
+        'code': code, 'expected': sorted_features(test_cases[code]), 'actual': sorted_features(actual),
+        'passed': actual == test_cases[code], 'duration': profile.seconds, 'skipped': profile.skipped
+    } for code, (actual, profile) in zip(codes, features.get_profiled_features_from_sources(codes, processes))]
+
+    # Skipped test cases are counted separately, since their detection failed instead of detecting other features
+    failed_cases = [case for case in cases if not case['passed'] and not case['skipped']]
+    return {
+        'vermin_version': vermin.constants.VERSION,
+        'analyzer_fingerprint': analyzer_fingerprint(),
+        'total': len(cases),
+        'failed': len(failed_cases),
+        'skipped': sum(1 for case in cases if case['skipped']),
+        'failed_per_version': dict(sorted(Counter(newest_version(case['expected']) for case in failed_cases).items(),
+                                          key=lambda item: tuple(map(int, item[0].split('.'))))),
+        'duration': sum(case['duration'] for case in cases),
+        'cases': cases
+    }
+
+
+def save_validation_report(report: dict, report_file: Path = VALIDATION_REPORT_FILE) -> None:
+    with report_file.open('w') as f:
+        json.dump(report, f, indent=2)
+
+
+def load_validation_report(report_file: Path = VALIDATION_REPORT_FILE) -> dict:
+    with report_file.open() as f:
+        return json.load(f)
+
+
+def plot_validation_report(report: dict) -> None:
+    tested_features = tested_features_per_python_version({case['code']: case['expected'] for case in report['cases']})
+    plot_vermin_vs_test_features(vermin_rules_per_python_version(), tested_features, report['failed_per_version'])
+
+
+def generated_test_cases_key(python_version: str) -> str:
+    """
+    :param python_version: Version of the Python source the test cases are generated from
+    :return: Hash of everything the generated test cases depend on: the Python source version, the generator code and
+    the analyzer fingerprint (since features of the test cases are combined with the features Vermin detects)
+    """
+    key = hashlib.sha256(f"{python_version}\n{analyzer_fingerprint()}\n".encode())
+    for generator_file in TEST_CASES_GENERATOR_FILES:
+        key.update(generator_file.read_bytes())
+    # Only the functions of this module that the generator uses, such that e.g. changing the validation report does not
+    # generate the test cases again
+    for function in (get_features_from_test_code, combine_features, save_test_cases):
+        key.update(inspect.getsource(function).encode())
+
+    return key.hexdigest()
+
+
+def generated_test_cases_up_to_date(python_version: str, test_cases_file: Path) -> bool:
+    key_file = test_cases_file.with_suffix('.key')
+    if not (test_cases_file.exists() and key_file.exists()):
+        return False
+
+    return key_file.read_text() == generated_test_cases_key(python_version)
 
-    with tmp_file.open('w') as f:
-        f.write(code)
 
-    # Only use 1 process for detecting features, since this function itself is already called in a subprocess
-    result = features.get_features(tmp_file, processes=1)
-    tmp_file.unlink()
-    return result
+def save_generated_test_cases_key(python_version: str, test_cases_file: Path) -> None:
+    test_cases_file.with_suffix('.key').write_text(generated_test_cases_key(python_version))
 
 
 def save_test_cases(output_file: Path, test_cases: Mapping[str, Features]) -> None:
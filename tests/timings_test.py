@@ -0,0 +1,65 @@
+import json
+import unittest
+from tempfile import TemporaryDirectory
+
+from pyternity import features
+from pyternity.features import FileProfile
+from pyternity.timings import Timing, Timings
+from pyternity.utils import *
+
+
+class TestTimings(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = TemporaryDirectory()
+        self.timings_file = Path(self.directory.name) / 'timings.jsonl'
+        self.timings = Timings(slowest_files=2).open(self.timings_file)
+
+    def tearDown(self) -> None:
+        self.timings.close()
+        self.directory.cleanup()
+
+    def test_summary(self):
+        self.timings.record(Timing('download', 'example', '1.0', 2.0, 1000))
+        self.timings.record(Timing('download', 'example', '1.1', 0.5, 500))
+        for path, seconds in (('a.py', 0.1), ('b.py', 3.0), ('c.py', 1.0)):
+            self.timings.record_file('example', '1.0', path, b"x" * 100, FileProfile(seconds))
+
+        self.assertEqual(self.timings.stage_totals['download'], (2.5, 1500, 0))
+        self.assertEqual(self.timings.stage_totals['analysis'], (4.1, 300, 3))
+        self.assertEqual([(project, release) for project, release, _ in self.timings.slowest_releases()],
+                         [('example', '1.0'), ('example', '1.1')])
+        self.assertEqual([timing.file for timing in self.timings.slowest_files()], ['b.py', 'c.py'])
+
+        self.timings.close()
+        with self.timings_file.open() as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(lines[0], Timing('download', 'example', '1.0', 2.0, 1000)._asdict())
+
+    def test_measure_files(self):
+        source_files = [('a.py', b"import zoneinfo\n"), ('b.py', b"")]
+        measured = self.timings.measure_files('extraction', 'example', '1.0', source_files)
+        self.assertEqual(list(measured), source_files)
+        self.assertEqual(self.timings.stage_totals['extraction'][1:], (16, 2))
+
+    def test_analyzed_files(self):
+        analyzed = []
+        source_files = [('a.py', b"import zoneinfo\n"), ('b.py', b"def f(a, /): pass\n")]
+        features.get_features_from_source_files(source_files, processes=1,
+                                                on_analyzed=lambda *args: analyzed.append(args))
+
+        self.assertEqual([(path, source) for path, source, _ in analyzed], source_files)
+
+    def test_skipped_files(self):
+        self.timings.close()
+        self.timings.open(self.timings_file, profile_slowest=1)
+        self.timings.record_file('example', '1.0', 'a.py', b"a = 1", FileProfile(1.0, 3, 1000))
+        self.timings.record_file('example', '1.0', 'b.py', b"b = 2", FileProfile(2.0, 5, 2000, "took more than 2s"))
+
+        self.assertEqual([timing.file for timing in self.timings.skipped_files], ['b.py'])
+        self.assertEqual([(timing.file, source) for timing, source in self.timings.slowest_sources()][0],
+                         ('b.py', b"b = 2"))
+
+
+if __name__ == '__main__':
+    unittest.main()
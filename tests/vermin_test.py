@@ -1,6 +1,6 @@
 import subprocess
+from unittest import mock
 
-from pyternity.plotting import plot_vermin_vs_test_features
 from pyternity.utils import *
 from tests.test_utils import *
 
@@ -73,42 +73,73 @@ class TestFeatures(unittest.TestCase):
         Note: As it turns out, the changelog pages itself don't always include all changes from the whole documentation
         """
 
-        # Clear previous run
-        TEST_CASES_FILE_PY2.unlink(missing_ok=True)
-        TEST_CASES_FILE_PY3.unlink(missing_ok=True)
-
         # We combine the results, since some features are both belonging to python 2.x and python 3.x
         # We need the whole Python source, since a sphinx-extension uses relative importing
 
         # Using Sphinx app twice in same Python process does cause some errors, so run them in a subprocess (parallel)
-        sub2 = subprocess.Popen([
-            sys.executable, TESTS_DIR / "generate_test_cases.py", TMP_DIR / f"Python-{PYTHON_2_VERSION}" / 'Doc',
-            TEST_CASES_FILE_PY2.absolute()
-        ])
-        sub3 = subprocess.Popen([
-            sys.executable, TESTS_DIR / "generate_test_cases.py", TMP_DIR / f"Python-{PYTHON_3_VERSION}" / 'Doc',
-            TEST_CASES_FILE_PY3.absolute()
-        ])
-        self.assertEqual(sub2.wait(), 0)
-        self.assertEqual(sub3.wait(), 0)
+        # Test cases are only generated again when the Python source version or the generator changed
+        generators = []
+        python_versions = ((PYTHON_2_VERSION, TEST_CASES_FILE_PY2), (PYTHON_3_VERSION, TEST_CASES_FILE_PY3))
+        for version, test_cases_file in python_versions:
+            if generated_test_cases_up_to_date(version, test_cases_file):
+                logger.info(f"Test cases of Python {version} are up to date, not generating them again")
+                continue
+
+            test_cases_file.unlink(missing_ok=True)
+            generators.append((version, test_cases_file, subprocess.Popen([
+                sys.executable, TESTS_DIR / "generate_test_cases.py", TMP_DIR / f"Python-{version}" / 'Doc',
+                test_cases_file.absolute()
+            ])))
+
+        for version, test_cases_file, generator in generators:
+            self.assertEqual(generator.wait(), 0)
+            save_generated_test_cases_key(version, test_cases_file)
 
         test_cases = get_test_cases()
 
-        failed_per_version = defaultdict(int)
+        # Detect the features of all test cases at once, then test them (in alphabetic order)
+        report = validate_test_cases(test_cases)
+        save_validation_report(report)
+        logger.info(f"{report['failed']} of {report['total']} test cases failed and {report['skipped']} were skipped, "
+                    f"see {VALIDATION_REPORT_FILE}")
 
-        # Now test the generated test cases (in alphabetic order)
-        for code, expected in sorted(test_cases.items()):
-            with self.subTest(code):
-                try:
-                    test_code(self, code, expected)
-                except AssertionError:
-                    version = max(expected.keys(), key=lambda versions: tuple(map(int, versions.split('.'))))
-                    failed_per_version[version] += 1
-                    raise
+        for case in report['cases']:
+            with self.subTest(case['code']):
+                self.assertIsNone(case['skipped'], case['code'])
+                self.assertTrue(case['passed'], msg_features(case['code'], case['actual'], case['expected']))
 
         logger.info("Plotting Vermin vs Test graph ...")
-        plot_vermin_vs_test_features(vermin_rules_per_python_version(),
-                                     tested_features_per_python_version(test_cases), failed_per_version)
+        plot_validation_report(report)
+
+
+class TestValidation(unittest.TestCase):
+    def test_validate_test_cases(self):
+        test_cases = PYTHON_3_9 | {
+            "import graphlib\nimport zoneinfo": {'3.9': {"'zoneinfo' module": 1}},
+            "import crashing": {'2.0': {"'crashing' module": 1}}
+        }
+        get_source_features = features.get_source_features
+
+        def raise_on_crashing(path: str, source: bytes, *args) -> FileFeatures | None:
+            if source == b"import crashing":
+                raise TypeError("crashed")
+            return get_source_features(path, source, *args)
+
+        for processes in (1, 2):
+            # The worker processes are forked, so these use the patched function as well
+            with self.subTest(processes=processes), \
+                    mock.patch.object(features, 'get_source_features', raise_on_crashing):
+                report = validate_test_cases(test_cases, processes)
+                self.assertEqual((report['total'], report['failed'], report['skipped']), (len(test_cases), 1, 1))
+                self.assertEqual(report['failed_per_version'], {'3.9': 1})
+                self.assertEqual([case['code'] for case in report['cases']], sorted(test_cases))
+                self.assertTrue(all(case['duration'] > 0 for case in report['cases']))
+
+                failed_case = next(case for case in report['cases'] if not case['passed'] and not case['skipped'])
+                self.assertEqual(failed_case['actual'], {'3.9': {"'graphlib' module": 1, "'zoneinfo' module": 1}})
+                skipped_case = next(case for case in report['cases'] if case['skipped'])
+                self.assertEqual((skipped_case['code'], skipped_case['skipped']),
+                                 ("import crashing", "raised TypeError: crashed"))
 
 
 class TestGenerator(unittest.TestCase):